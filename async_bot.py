@@ -0,0 +1,476 @@
+"""Режим asyncio: те же обработчики, что и в bot.py, но на AsyncTeleBot.
+
+Запросы к Telegram не занимают поток и идут через sender.AsyncDispatcher (порядок по чатам,
+лимиты, повтор при 429, схлопывание правок), SQLite выполняется в пуле потоков,
+строки Google Sheets уходят фоновым потоком sheet_writer.
+Общее состояние (БД, кеш пользователей, сценарии, переводы) берется из модуля bot.
+"""
+import asyncio
+import functools
+import html
+import os
+from datetime import datetime
+
+from telebot import asyncio_helper, util
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import ReplyKeyboardRemove
+
+import bot as core
+from bot import catalog, conversations, get_text
+
+abot = AsyncTeleBot(core.TOKEN, parse_mode="HTML")
+# Сообщения, правки и файлы — через очередь с лимитами и повтором при 429, ведра общие с core.dispatcher
+dispatcher = core.sender.AsyncDispatcher(abot, core.dispatcher)
+
+
+async def run(fn, *args, **kwargs):
+    """Выполняет блокирующий вызов (SQLite) в пуле потоков."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+
+async def get_user(tg_id):
+    row = core.user_cache.get(tg_id)
+    if row is not None:
+        return row
+    return await run(core.get_or_create_user, tg_id)
+
+
+async def main_menu(chat_id, lang):
+    await dispatcher.send_message(chat_id, get_text("main_menu_title", lang),
+                                  reply_markup=core.main_menu_keyboard(lang, chat_id in core.ADMIN_IDS))
+
+
+async def in_step(message):
+    step, _ = await run(conversations.get, message.chat.id)
+    return step in STEP_HANDLERS
+
+
+@abot.message_handler(func=in_step, content_types=util.content_type_media)
+async def handle_step(message):
+    step, data = await run(conversations.get, message.chat.id)
+    _, _, lang = await get_user(message.from_user.id)
+    await STEP_HANDLERS[step](message, lang, data)
+
+
+@abot.message_handler(commands=['start'])
+async def start(message):
+    user_id, agreed, lang = await get_user(message.from_user.id)
+    core.db.set_unblocked(message.from_user.id)
+
+    if not lang:
+        await dispatcher.send_message(message.chat.id, get_text('choose_language', 'ru'),
+                                      reply_markup=core.language_keyboard("initial_lang_"))
+        return
+
+    if agreed:
+        await main_menu(message.chat.id, lang)
+    else:
+        await dispatcher.send_message(
+            message.chat.id,
+            get_text("agreement_prompt", lang),
+            reply_markup=core.yes_no_keyboard(lang, "agree_yes_btn", "agree_no_btn", "agree"),
+            parse_mode="HTML", disable_web_page_preview=True
+        )
+
+
+@abot.callback_query_handler(func=lambda call: call.data.startswith("initial_lang_"))
+async def initial_set_language(call):
+    lang_code = call.data.split("_")[-1]
+    await run(core.db.set_language, call.from_user.id, lang_code)
+    core.user_cache.update(call.from_user.id, language_code=lang_code)
+    await asyncio.gather(
+        abot.answer_callback_query(call.id, get_text("language_selected", lang_code)),
+        dispatcher.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+    )
+    await start(call.message)
+
+
+@abot.callback_query_handler(func=lambda call: call.data.startswith("change_lang_"))
+async def change_language_from_settings(call):
+    lang_code = call.data.split("_")[-1]
+    await run(core.db.set_language, call.from_user.id, lang_code)
+    core.user_cache.update(call.from_user.id, language_code=lang_code)
+    await asyncio.gather(
+        abot.answer_callback_query(call.id, get_text("language_selected", lang_code)),
+        dispatcher.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id),
+        main_menu(call.message.chat.id, lang_code)
+    )
+
+
+@abot.callback_query_handler(func=lambda call: call.data in ["agree_yes", "agree_no"])
+async def handle_agreement(call):
+    _, _, lang = await get_user(call.from_user.id)
+    await abot.answer_callback_query(call.id)
+    if call.data == "agree_no":
+        await dispatcher.edit_message_text(get_text("agree_no_reply", lang),
+                                           chat_id=call.message.chat.id, message_id=call.message.message_id)
+    else:
+        await run(core.db.set_agreed, call.from_user.id)
+        core.user_cache.update(call.from_user.id, agreed=1)
+        await asyncio.gather(
+            dispatcher.edit_message_text(get_text("agree_thanks", lang),
+                                         chat_id=call.message.chat.id, message_id=call.message.message_id),
+            main_menu(call.message.chat.id, lang)
+        )
+
+
+# ---------------- Главное меню ----------------
+@abot.message_handler(func=lambda m: not util.is_command(m.text or ""))
+async def handle_text(message):
+    _, _, lang = await get_user(message.from_user.id)
+
+    action = catalog.action(lang, message.text)
+    if action is None or (action in core.ADMIN_ACTIONS and message.chat.id not in core.ADMIN_IDS):
+        return
+    await MENU_HANDLERS[action](message, lang)
+
+
+async def show_settings(message, lang):
+    await dispatcher.send_message(message.chat.id, get_text('settings_menu_title', lang),
+                                  reply_markup=core.language_keyboard("change_lang_", lang))
+
+
+@abot.callback_query_handler(func=lambda call: call.data == "back_to_main")
+async def back_to_main_handler(call):
+    await asyncio.gather(
+        abot.answer_callback_query(call.id),
+        dispatcher.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+    )
+
+
+async def order_start(message, lang):
+    conversations.set(message.chat.id, "name", {})
+    await dispatcher.send_message(message.chat.id, get_text("get_name_prompt", lang))
+
+
+async def my_orders(message, lang):
+    user_id, _, _ = await get_user(message.from_user.id)
+    order = await run(core.db.first_user_order, user_id)
+    if not order:
+        await dispatcher.send_message(message.chat.id, get_text("no_orders", lang))
+        return
+    total_orders = await run(core.db.count_user_orders, user_id)
+    await send_order_message(message.chat.id, lang, order, 0, total_orders)
+
+
+async def send_order_message(chat_id, lang, order, index, total_orders, message_id=None):
+    text = catalog.render(
+        "order_card", lang, index=index + 1, total=total_orders, code=order[1], full_name=order[2],
+        phone=order[3], order_number=order[4], order_date=order[5],
+        location=core.get_location_link(order[6], order[7], lang)
+    )
+    kb = core.orders_keyboard(lang, order[0], index)
+    if message_id is None:
+        await dispatcher.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML", disable_web_page_preview=True)
+        return
+    # Неудачная правка (сообщение удалено, слишком старое) уже записана в лог — присылаем карточку заново.
+    # Правка, которую заменило более позднее перелистывание, возвращает None: карточку покажет оно
+    try:
+        await dispatcher.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode="HTML",
+                                           disable_web_page_preview=True, reply_markup=kb, raise_errors=True)
+    except Exception:
+        await dispatcher.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML", disable_web_page_preview=True)
+
+
+@abot.callback_query_handler(func=lambda call: call.data.split(":")[0] in ["prev", "next"])
+async def switch_order(call):
+    user_id, _, lang = await get_user(call.from_user.id)
+    parts = call.data.split(":")
+    total_orders = await run(core.db.count_user_orders, user_id)
+
+    if len(parts) != 3 or not total_orders:
+        await abot.answer_callback_query(call.id, get_text("order_info_error", lang), show_alert=True)
+        return
+
+    order, index = await run(core.neighbour_order, user_id, parts[0], int(parts[1]), int(parts[2]), total_orders)
+    await asyncio.gather(
+        abot.answer_callback_query(call.id),
+        send_order_message(call.message.chat.id, lang, order, index, total_orders,
+                           message_id=call.message.message_id)
+    )
+
+
+# ---------------- Admin Functions ----------------
+async def get_stats(message, lang):
+    await dispatcher.send_message(message.chat.id, await run(core.stats_text, lang))
+
+
+async def get_order_info_start(message, lang):
+    conversations.set(message.chat.id, "admin_find", {})
+    await dispatcher.send_message(message.chat.id, get_text("admin_find_order_prompt", lang))
+
+
+async def find_order_by_applicant_number(message, lang, data=None):
+    conversations.clear(message.chat.id)
+    applicant_order_number = (message.text or "").strip()
+    order = await run(core.db.find_order, applicant_order_number)
+
+    if not order:
+        text = await run(core.search_results_text, applicant_order_number, lang, 0)
+        if text is None:
+            await dispatcher.send_message(message.chat.id,
+                                          get_text("admin_order_not_found", lang).format(number=applicant_order_number))
+            return
+        conversations.set(message.chat.id, "results", {"query": applicant_order_number}, flow="search")
+        await dispatcher.send_message(message.chat.id, text[0], reply_markup=text[1], disable_web_page_preview=True)
+        return
+
+    text = catalog.render(
+        "admin_order", lang, number=order[0], full_name=order[1], phone=order[2], tg_id=order[6],
+        order_number=order[3], order_date=order[4], location=order[5]
+    )
+    await dispatcher.send_message(message.chat.id, text, disable_web_page_preview=True)
+
+
+@abot.callback_query_handler(func=lambda call: call.data.startswith("search:") and call.message.chat.id in core.ADMIN_IDS)
+async def switch_search_page(call):
+    _, _, lang = await get_user(call.from_user.id)
+    _, data = await run(conversations.get, call.message.chat.id, "search")
+    text = await run(core.search_results_text, data["query"], lang, int(call.data.split(":")[1])) if data else None
+    if text is None:
+        await abot.answer_callback_query(call.id, get_text("order_info_error", lang), show_alert=True)
+        return
+    await asyncio.gather(
+        abot.answer_callback_query(call.id),
+        dispatcher.edit_message_text(text[0], chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                     reply_markup=text[1], disable_web_page_preview=True)
+    )
+
+
+@abot.message_handler(commands=['broadcast'], func=lambda m: m.chat.id in core.ADMIN_IDS)
+async def broadcast_start(message):
+    _, _, lang = await get_user(message.from_user.id)
+    conversations.set(message.chat.id, "broadcast_text", {})
+    await dispatcher.send_message(message.chat.id, get_text("admin_broadcast_prompt", lang))
+
+
+async def broadcast_text(message, lang, data=None):
+    conversations.clear(message.chat.id)
+    if not message.text:
+        return
+    broadcast_id = await run(core.broadcaster.start, message.text, message.chat.id, lang)
+    await dispatcher.send_message(message.chat.id, get_text("admin_broadcast_started", lang).format(id=broadcast_id))
+
+
+@abot.message_handler(commands=['export'], func=lambda m: m.chat.id in core.ADMIN_IDS)
+async def export_orders(message):
+    _, _, lang = await get_user(message.from_user.id)
+    filters = core.export.parse_filters(util.extract_arguments(message.text).split())
+    if filters is None:
+        await dispatcher.send_message(message.chat.id, get_text("admin_export_usage", lang))
+        return
+    if filters["fmt"] == "xlsx" and not core.export.xlsx_available():
+        await dispatcher.send_message(message.chat.id, get_text("admin_export_no_xlsx", lang))
+        filters["fmt"] = "csv"
+    await dispatcher.send_message(message.chat.id, get_text("admin_export_started", lang))
+    path, count = await run(core.export.write_export, **filters)
+    try:
+        if not count:
+            await dispatcher.send_message(message.chat.id, get_text("admin_export_empty", lang))
+            return
+        with open(path, "rb") as document:
+            await dispatcher.send_document(
+                message.chat.id, document, caption=get_text("admin_export_done", lang).format(count=count),
+                visible_file_name=core.export.file_name(**filters)
+            )
+    finally:
+        os.remove(path)
+
+
+@abot.message_handler(commands=['status'], func=lambda m: m.chat.id in core.ADMIN_IDS)
+async def change_order_status(message):
+    _, _, lang = await get_user(message.from_user.id)
+    args = util.extract_arguments(message.text).split(maxsplit=1)
+    if len(args) != 2:
+        await dispatcher.send_message(message.chat.id, get_text("admin_status_usage", lang))
+        return
+    number, status = args
+    if await run(core.db.set_order_status, number, status):
+        await dispatcher.send_message(message.chat.id, get_text("admin_status_updated", lang).format(
+            number=html.escape(number), status=html.escape(status)))
+    else:
+        await dispatcher.send_message(message.chat.id,
+                                      get_text("admin_order_not_found", lang).format(number=html.escape(number)))
+
+
+@abot.message_handler(commands=['near'], func=lambda m: m.chat.id in core.ADMIN_IDS)
+async def near_start(message):
+    _, _, lang = await get_user(message.from_user.id)
+    filters = core.geo.parse_near_args(util.extract_arguments(message.text).split())
+    if filters is None:
+        await dispatcher.send_message(message.chat.id, get_text("admin_near_usage", lang))
+        return
+    conversations.set(message.chat.id, "near_point", filters)
+    await dispatcher.send_message(message.chat.id, get_text("admin_near_prompt", lang).format(
+        radius=f"{filters['radius_km']:g}", status=html.escape(filters["status"])),
+        reply_markup=core.location_keyboard(lang))
+
+
+async def near_point(message, lang, data):
+    conversations.clear(message.chat.id)
+    if message.location:
+        point = (message.location.latitude, message.location.longitude)
+    else:
+        point = core.geo.parse_point(message.text)
+    if point is None:
+        await dispatcher.send_message(message.chat.id, get_text("admin_near_no_point", lang), reply_markup=ReplyKeyboardRemove())
+        return
+    text = await run(core.near_text, *point, data["radius_km"], data["status"], lang)
+    await dispatcher.send_message(message.chat.id, text, reply_markup=ReplyKeyboardRemove(), disable_web_page_preview=True)
+
+
+@abot.message_handler(commands=['zones'], func=lambda m: m.chat.id in core.ADMIN_IDS)
+async def delivery_zones(message):
+    _, _, lang = await get_user(message.from_user.id)
+    filters = core.geo.parse_zone_args(util.extract_arguments(message.text).split())
+    if filters is None:
+        await dispatcher.send_message(message.chat.id, get_text("admin_zones_usage", lang))
+        return
+    await dispatcher.send_message(message.chat.id, await run(core.zones_text, lang, **filters), disable_web_page_preview=True)
+
+
+async def help_message(message, lang):
+    await dispatcher.send_message(message.chat.id, get_text("help_text", lang))
+
+
+# ---------------- ORDERING PROCESS ----------------
+async def get_name(message, lang, data):
+    full_name = (message.text or "").strip()
+    if len(full_name.split()) < 2:
+        await dispatcher.send_message(message.chat.id, get_text("name_error", lang))
+        return
+    data['full_name'] = full_name
+    conversations.set(message.chat.id, "phone", data)
+    await dispatcher.send_message(message.chat.id, get_text("get_phone_prompt", lang))
+
+
+async def get_phone(message, lang, data):
+    phone = (message.text or "").strip()
+    if not phone.startswith("+"):
+        await dispatcher.send_message(message.chat.id, get_text("phone_error", lang))
+        return
+    data['phone'] = phone
+    data['tg_id'] = message.from_user.id
+    conversations.set(message.chat.id, "confirm", data)
+
+    text = catalog.render("confirm_data", lang, full_name=data['full_name'], phone=data['phone'])
+    await dispatcher.send_message(message.chat.id, text,
+                                  reply_markup=core.yes_no_keyboard(lang, "confirm_yes_btn", "confirm_no_btn", "confirm"))
+
+
+@abot.callback_query_handler(func=lambda call: call.data in ["confirm_yes", "confirm_no"])
+async def confirm_data(call):
+    user_id, _, lang = await get_user(call.from_user.id)
+    await abot.answer_callback_query(call.id)
+    if call.data == "confirm_no":
+        conversations.set(call.message.chat.id, "name", {})
+        await dispatcher.edit_message_text(get_text("restart_prompt", lang),
+                                           chat_id=call.message.chat.id, message_id=call.message.message_id)
+    else:
+        step, data = await run(conversations.get, call.message.chat.id)
+        if step != "confirm":
+            await dispatcher.edit_message_text(get_text("order_info_error", lang), chat_id=call.message.chat.id,
+                                               message_id=call.message.message_id)
+            return
+        conversations.set(call.message.chat.id, "order_number", data)
+        await dispatcher.edit_message_text(core.address_text(lang, user_id),
+                                           chat_id=call.message.chat.id, message_id=call.message.message_id)
+
+
+async def get_order_number(message, lang, data):
+    if message.text is None:
+        await dispatcher.send_message(message.chat.id, get_text("get_order_number_error", lang))
+        return
+    data['order_number'] = message.text.strip()
+    data['order_date'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conversations.set(message.chat.id, "location", data)
+    await dispatcher.send_message(message.chat.id, get_text("get_location_prompt", lang),
+                                  reply_markup=core.location_keyboard(lang))
+
+
+@abot.message_handler(content_types=['location'])
+async def get_location(message):
+    user_id, _, lang = await get_user(message.from_user.id)
+    chat_id = message.chat.id
+    step, data = await run(conversations.get, chat_id)
+    if step not in ("location", "save"):
+        return
+
+    data['latitude'] = message.location.latitude
+    data['longitude'] = message.location.longitude
+    conversations.set(chat_id, "save", data)
+
+    summary = catalog.render(
+        "final_check", lang, full_name=data['full_name'], phone=data['phone'], user_id=user_id,
+        order_number=data['order_number'], order_date=data['order_date'],
+        location=core.get_location_link(message.location.latitude, message.location.longitude, lang)
+    )
+    # Порядок сообщений в чате важен, поэтому здесь отправки идут друг за другом
+    await dispatcher.send_message(chat_id, get_text("location_received", lang), reply_markup=ReplyKeyboardRemove())
+    await dispatcher.send_message(chat_id, summary, parse_mode="HTML", disable_web_page_preview=True,
+                                  reply_markup=core.yes_no_keyboard(lang, "final_confirm_btn", "final_reject_btn", "save"))
+
+
+@abot.callback_query_handler(func=lambda call: call.data in ["save_yes", "save_no"])
+async def final_save(call):
+    chat_id = call.message.chat.id
+    _, _, lang = await get_user(call.from_user.id)
+    await abot.answer_callback_query(call.id)
+
+    if call.data == "save_no":
+        conversations.set(chat_id, "name", {})
+        await dispatcher.edit_message_text(get_text("final_restart_prompt", lang),
+                                           chat_id=chat_id, message_id=call.message.message_id)
+        return
+
+    step, data = await run(conversations.get, chat_id)
+    if step != "save":
+        await dispatcher.edit_message_text(get_text("order_info_error", lang), chat_id=chat_id,
+                                           message_id=call.message.message_id)
+        return
+    order_text_for_group, order_text_for_user = await run(core.store_order, data, lang)
+    conversations.clear(chat_id)
+
+    # Уведомление группы, подтверждение и меню независимы — отправляем одновременно
+    await asyncio.gather(
+        dispatcher.send_message(core.GROUP_ID, order_text_for_group, parse_mode="HTML", disable_web_page_preview=True),
+        dispatcher.edit_message_text(chat_id=chat_id, message_id=call.message.message_id,
+                                     text=order_text_for_user, parse_mode="HTML", disable_web_page_preview=True),
+        main_menu(chat_id, lang)
+    )
+
+
+MENU_HANDLERS = {
+    "order": order_start,
+    "my_orders": my_orders,
+    "stats": get_stats,
+    "order_info": get_order_info_start,
+    "help": help_message,
+    "settings": show_settings,
+}
+
+STEP_HANDLERS = {
+    "name": get_name,
+    "phone": get_phone,
+    "order_number": get_order_number,
+    "admin_find": find_order_by_applicant_number,
+    "broadcast_text": broadcast_text,
+    "near_point": near_point,
+}
+
+
+def main():
+    if core.BOT_API_URL:
+        asyncio_helper.API_URL = core.BOT_API_URL
+    if core.METRICS_PORT:
+        core.metrics.instrument_handlers(abot)
+        core.metrics.instrument_table(MENU_HANDLERS)
+        core.metrics.instrument_table(STEP_HANDLERS)
+        core.metrics.registry.add_gauges("async_dispatcher", dispatcher.metrics)
+    core.start_background()
+    core.print_startup_report()
+    asyncio.run(abot.infinity_polling())
+
+
+if __name__ == '__main__':
+    main()
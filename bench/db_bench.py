@@ -0,0 +1,82 @@
+"""Сравнение пропускной способности SQLite: общее соединение с commit на каждый UPDATE
+против модуля db (WAL, соединения на поток, один поток записи с group commit).
+
+    python bench/db_bench.py --threads 8 --ops 2000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import db  # noqa: E402
+
+
+def run_threads(threads, ops, read_op, write_op, write_every):
+    def worker(n):
+        for i in range(ops):
+            tg_id = (n * ops + i) % 1000 + 1
+            if i % write_every == 0:
+                write_op(tg_id)
+            else:
+                read_op(tg_id)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return threads * ops / (time.perf_counter() - start)
+
+
+def seed(path):
+    conn = db.connect(path)
+    conn.execute("BEGIN")
+    db.init_schema(conn)
+    conn.executemany("INSERT INTO users (tg_id) VALUES (?)", [(i,) for i in range(1, 1001)])
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def bench_shared(path, args):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=DELETE")
+
+    def read_op(tg_id):
+        conn.execute("SELECT id, agreed, language_code FROM users WHERE tg_id = ?", (tg_id,)).fetchone()
+
+    def write_op(tg_id):
+        conn.execute("UPDATE users SET language_code = ? WHERE tg_id = ?", ("en", tg_id))
+        conn.commit()
+
+    return run_threads(args.threads, args.ops, read_op, write_op, args.write_every)
+
+
+def bench_db(path, args):
+    db.init(path)
+    return run_threads(args.threads, args.ops, db.get_user, lambda tg_id: db.set_language(tg_id, "en"),
+                       args.write_every)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--write-every", type=int, default=5, help="каждая N-я операция — запись")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before, after = os.path.join(tmp, "before.db"), os.path.join(tmp, "after.db")
+        seed(before)
+        seed(after)
+        print(f"shared connection: {bench_shared(before, args):.0f} ops/s")
+        print(f"db module:         {bench_db(after, args):.0f} ops/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Задержка поиска заказов (search.py) на синтетической базе.
+
+    python bench/fts_bench.py                         # 1 000 000 заказов во временной БД
+    python bench/fts_bench.py --orders 200000 --db /tmp/orders.db --repeat 50
+
+База создается один раз: при повторном запуске с тем же --db заказы не добавляются.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import db  # noqa: E402
+import search  # noqa: E402
+
+FIRST = ["Ivan", "Anna", "Aziz", "Dilnoza", "Sergey", "Olga", "Timur", "Madina", "Rustam", "Elena"]
+LAST = ["Petrov", "Karimov", "Ivanova", "Tashkentov", "Yusupova", "Smirnov", "Rakhimov", "Li", "Kim", "Sidorov"]
+
+
+def seed(path, orders, users):
+    conn = db.connect(path)
+    conn.execute("BEGIN")
+    db.init_schema(conn)
+    have = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    if have >= orders:
+        conn.execute("COMMIT")
+        return conn
+    rnd = random.Random(1)
+    conn.executemany("INSERT OR IGNORE INTO users (tg_id) VALUES (?)", [(i,) for i in range(1, users + 1)])
+    batch = []
+    start = time.perf_counter()
+    for n in range(have, orders):
+        batch.append((
+            rnd.randint(1, users),
+            f"{rnd.choice(FIRST)} {rnd.choice(LAST)}{n % 997}",
+            f"+99890{rnd.randint(0, 9_999_999):07d}",
+            f"TB-{rnd.randint(10 ** 9, 10 ** 10 - 1)}",
+            f"2025-{n % 12 + 1:02d}-{n % 28 + 1:02d} 12:00:00",
+            f"Gv{1001 + n}",
+        ))
+        if len(batch) == 10_000:
+            conn.executemany("INSERT INTO orders (user_id, full_name, phone, order_number, order_date, applicant_order_number) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO orders (user_id, full_name, phone, order_number, order_date, applicant_order_number) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.execute("COMMIT")
+    print(f"seeded {orders - have} orders (with FTS triggers) in {time.perf_counter() - start:.1f}s")
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--db", help="путь к БД; по умолчанию временный файл")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "fts.db")
+    conn = seed(path, args.orders, args.users)
+    conn.execute("PRAGMA optimize")
+
+    queries = {
+        "applicant code": f"Gv{1001 + args.orders // 2}",
+        "phone part": "9012345",
+        "surname": "Karimov5",
+        "taobao part": "TB-12345",
+        "name + surname": "Anna Petrov1",
+        "broad (many hits)": "+99890",
+    }
+    print(f"{'query':<20} {'hits':>6} {'p50 ms':>8} {'p95 ms':>8} {'page 3 p50 ms':>14}")
+    for label, text in queries.items():
+        timings, deep = [], []
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            _, total = search.search_orders(conn, text, 0)
+            timings.append((time.perf_counter() - t) * 1000)
+            t = time.perf_counter()
+            search.search_orders(conn, text, 2)
+            deep.append((time.perf_counter() - t) * 1000)
+        timings.sort()
+        print(f"{label:<20} {total:>6} {statistics.median(timings):>8.2f} "
+              f"{timings[int(len(timings) * 0.95) - 1]:>8.2f} {statistics.median(deep):>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
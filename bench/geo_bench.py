@@ -0,0 +1,123 @@
+"""Задержка поиска заказов рядом с точкой и зон доставки (geo.py) на синтетической базе.
+
+    python bench/geo_bench.py                         # 500 000 заказов во временной БД
+    python bench/geo_bench.py --orders 200000 --db /tmp/geo.db --repeat 50
+
+Для сравнения тот же поиск выполняется полным проходом по orders с haversine для каждой строки.
+База создается один раз: при повторном запуске с тем же --db заказы не добавляются.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import db  # noqa: E402
+import geo  # noqa: E402
+
+# Города, вокруг которых разбросаны точки заказов: (широта, долгота, доля заказов)
+CITIES = [(41.311, 69.279, 0.55), (39.654, 66.959, 0.15), (40.783, 72.350, 0.1), (40.103, 65.374, 0.1),
+          (41.549, 60.631, 0.1)]
+DAYS = 365
+
+
+def seed(path, orders, users):
+    conn = db.connect(path)
+    conn.execute("BEGIN")
+    db.init_schema(conn)
+    have = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    if have >= orders:
+        conn.execute("COMMIT")
+        return conn
+    rnd = random.Random(1)
+    conn.executemany("INSERT OR IGNORE INTO users (tg_id) VALUES (?)", [(i,) for i in range(1, users + 1)])
+    weights = [share for _, _, share in CITIES]
+    batch = []
+    start = time.perf_counter()
+    for n in range(have, orders):
+        lat, lon, _ = rnd.choices(CITIES, weights)[0]
+        batch.append((
+            rnd.randint(1, users),
+            lat + rnd.gauss(0, 0.05),
+            lon + rnd.gauss(0, 0.06),
+            f"{date.fromordinal(date(2025, 1, 1).toordinal() + n % DAYS)} 12:00:00",
+            f"Gv{1001 + n}",
+            "new" if rnd.random() < 0.2 else "delivered",
+        ))
+        if len(batch) == 10_000:
+            conn.executemany("INSERT INTO orders (user_id, latitude, longitude, order_date, applicant_order_number, status) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO orders (user_id, latitude, longitude, order_date, applicant_order_number, status) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.execute("COMMIT")
+    print(f"seeded {orders - have} orders in {time.perf_counter() - start:.1f}s")
+    return conn
+
+
+def near_full_scan(conn, latitude, longitude, radius_km, status):
+    found = []
+    for code, full_name, phone, lat, lon in conn.execute(
+        "SELECT applicant_order_number, full_name, phone, latitude, longitude FROM orders "
+        "WHERE status = ? AND latitude IS NOT NULL", (status,)
+    ):
+        distance = geo.distance_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            found.append((distance, code, full_name, phone, lat, lon))
+    found.sort()
+    return found[:geo.NEAR_LIMIT], len(found)
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - t) * 1000)
+    timings.sort()
+    return result, statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=500_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--db", help="путь к БД; по умолчанию временный файл")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "geo.db")
+    conn = seed(path, args.orders, args.users)
+    conn.execute("PRAGMA optimize")
+
+    tashkent, samarkand = CITIES[0][:2], CITIES[1][:2]
+    queries = {
+        "Tashkent 1 km": (*tashkent, 1.0),
+        "Tashkent 3 km": (*tashkent, 3.0),
+        "Tashkent 10 km": (*tashkent, 10.0),
+        "Samarkand 3 km": (*samarkand, 3.0),
+        "empty steppe 5 km": (43.0, 63.0, 5.0),
+    }
+    print(f"{'query':<20} {'hits':>6} {'p50 ms':>8} {'p95 ms':>8} {'full scan p50 ms':>17}")
+    for label, (lat, lon, radius) in queries.items():
+        (rows, total), p50, p95 = timed(lambda: geo.near_orders(conn, lat, lon, radius, "new"), args.repeat)
+        (scan_rows, scan_total), scan_p50, _ = timed(lambda: near_full_scan(conn, lat, lon, radius, "new"),
+                                                     max(1, args.repeat // 10))
+        assert (rows, total) == (scan_rows, scan_total), label
+        print(f"{label:<20} {total:>6} {p50:>8.2f} {p95:>8.2f} {scan_p50:>17.2f}")
+
+    day = date(2025, 6, 1)
+    for radius in (1.0, 2.0, 5.0):
+        zones, p50, p95 = timed(lambda: geo.zones(conn, day, radius), args.repeat)
+        print(f"zones {day} r={radius:g} km: {sum(zone[0] for zone in zones)} orders in {len(zones)} zones, "
+              f"p50 {p50:.2f} ms, p95 {p95:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,538 @@
+"""Нагрузочный прогон бота целиком: настоящие обработчики bot.py, поддельный Bot API и поддельная таблица.
+
+    python bench/loadtest.py --users 2000 --concurrency 64
+    python bench/loadtest.py --api-latency 0.05 --api-429 0.01 --sheet-latency 0.3 --sheet-429 0.1
+    python bench/loadtest.py --out results.json --baseline previous.json
+    python bench/loadtest.py --workers 4 --api-latency 0.02   # supervisor.py с 4 процессами
+
+Каждый пользователь проходит /start, выбор языка, согласие, оформление заказа
+(get_name -> get_phone -> confirm -> get_order_number -> get_location -> final_save),
+«Мои заказы» и листание switch_order. Бот ходит в HTTP-сервер, поднятый в этом же процессе
+(apihelper.API_URL), строки заказов уходят в FakeSheet с задержкой и ответами 429.
+Отчет: p50/p95/p99 по шагам, пропускная способность, ожидание записи в SQLite и group commit,
+отправка сообщений и таблица. --out пишет то же в JSON, --baseline сравнивает с прошлым прогоном.
+С --workers бот запускается отдельным процессом supervisor.py и получает обновления через getUpdates,
+а пользователь отправляет следующий шаг после ответа на предыдущий; счетчики SQLite и таблицы
+в этом режиме не собираются.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from supervisor import raw_chat_id  # noqa: E402
+
+
+# ---------------- Поддельный Bot API ----------------
+class FakeTelegram(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, rate_limit=0.0):
+        super().__init__(("127.0.0.1", 0), FakeTelegramHandler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.message_ids = itertools.count(1)
+        self.requests = {}
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+        # Для --workers: обновления отдаются через getUpdates, ответы считаются по чатам
+        self.pending = deque()
+        self.update_ids = itertools.count(1)
+        self.replies = {}
+        self.changed = threading.Condition()
+
+    def push(self, update):
+        """Ставит обновление в getUpdates и возвращает, сколько ответов в его чат уже было."""
+        with self.changed:
+            update["update_id"] = next(self.update_ids)
+            self.pending.append(update)
+            self.changed.notify_all()
+            return self.replies.get(raw_chat_id(update), 0)
+
+    def take(self, offset, limit, timeout):
+        with self.changed:
+            while self.pending and self.pending[0]["update_id"] < offset:
+                self.pending.popleft()
+            if not self.pending:
+                self.changed.wait(timeout)
+            return list(itertools.islice(self.pending, limit))
+
+    def reply(self, chat_id):
+        with self.changed:
+            self.replies[chat_id] = self.replies.get(chat_id, 0) + 1
+            self.changed.notify_all()
+
+    def wait_reply(self, chat_id, seen, timeout):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.replies.get(chat_id, 0) > seen, timeout)
+
+    def handle_error(self, request, client_address):
+        # Остановленный супервизор или воркер рвет соединения посреди long polling — это не ошибка прогона
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/bot{{0}}/{{1}}"
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Заголовки и тело уходят отдельными пакетами; без TCP_NODELAY каждый ответ ждет delayed ACK (~40 мс)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path, _, query = self.path.partition("?")
+        # telebot передает параметры в строке запроса, файлы — в теле
+        params = dict(parse_qsl(query))
+        if body and self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            params.update(parse_qsl(body.decode("utf-8", "replace")))
+        method = path.rsplit("/", 1)[-1]
+        if method == "getUpdates":
+            updates = server.take(int(params.get("offset", 0)), int(params.get("limit", 100)),
+                                  float(params.get("timeout", 0)))
+            return self._reply(200, {"ok": True, "result": updates})
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests[method] = server.requests.get(method, 0) + 1
+            limited = method != "answerCallbackQuery" and random.random() < server.rate_limit
+            if limited:
+                server.rate_limited += 1
+        if limited:
+            return self._reply(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                     "parameters": {"retry_after": 1}})
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            result = {"message_id": next(server.message_ids), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        else:
+            result = True
+        self._reply(200, {"ok": True, "result": result})
+        if "chat_id" in params:
+            server.reply(int(params["chat_id"]))
+
+    def _reply(self, code, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# ---------------- Поддельная таблица ----------------
+def flaky_sheet_factory(latency, rate_limit):
+    import sheets
+
+    class RateLimited(Exception):
+        pass
+
+    class FlakySheet(sheets.FakeSheet):
+        """FakeSheet, который с вероятностью rate_limit отвечает как Sheets API на превышение квоты."""
+        rate_limited = 0
+
+        def append_rows(self, values, **kwargs):
+            if random.random() < rate_limit:
+                FlakySheet.rate_limited += 1
+                time.sleep(self.latency)
+                raise RateLimited("APIError: [429]: Quota exceeded for quota metric 'Write requests'")
+            super().append_rows(values, **kwargs)
+
+    return FlakySheet, lambda: FlakySheet(latency)
+
+
+# ---------------- Сценарий пользователя ----------------
+class Script:
+    """Обновления одного пользователя в виде (шаг, update JSON)."""
+
+    def __init__(self, texts, tg_id, update_ids):
+        self.texts = texts
+        self.tg_id = tg_id
+        self.update_ids = update_ids
+
+    def _user(self):
+        return {"id": self.tg_id, "is_bot": False, "first_name": "load"}
+
+    def message(self, text=None, location=None, command=False):
+        msg = {"message_id": next(self.update_ids), "date": 1, "chat": {"id": self.tg_id, "type": "private"},
+               "from": self._user()}
+        if text is not None:
+            msg["text"] = text
+        if command:
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        if location:
+            msg["location"] = {"latitude": location[0], "longitude": location[1]}
+        return {"update_id": next(self.update_ids), "message": msg}
+
+    def callback(self, data):
+        return {"update_id": next(self.update_ids), "callback_query": {
+            "id": str(next(self.update_ids)), "chat_instance": "load", "data": data, "from": self._user(),
+            "message": {"message_id": next(self.update_ids), "date": 1, "chat": {"id": self.tg_id, "type": "private"},
+                        "from": {"id": 1, "is_bot": True, "first_name": "bot"}, "text": "x"}}}
+
+    def order(self, n):
+        t = self.texts
+        return [
+            ("order_button", self.message(t["main_menu_order_btn"])),
+            ("get_name", self.message(f"Load User{self.tg_id}")),
+            ("get_phone", self.message(f"+99890{self.tg_id % 10_000_000:07d}")),
+            ("confirm_data", self.callback("confirm_yes")),
+            ("get_order_number", self.message(f"TB-{self.tg_id}-{n}")),
+            ("get_location", self.message(location=(41.2 + random.random() / 10, 69.2 + random.random() / 10))),
+            ("final_save", self.callback("save_yes")),
+        ]
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def at(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+    return {"count": len(values), "p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99),
+            "max_ms": round(values[-1] * 1000, 3)}
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def report(self):
+        return {name: percentiles(values) for name, values in sorted(self.samples.items())}
+
+
+# ---------------- Прогон ----------------
+REPLY_TIMEOUT = 30.0
+
+
+def prepare_env(args):
+    tmp = tempfile.mkdtemp()
+    os.environ.update(BOT_TOKEN="1:load", GROUP_ID="-1", SHEETS_BACKEND="fake",
+                      DB_PATH=os.path.join(tmp, "load.db"), SHEETS_FLUSH_INTERVAL=str(args.sheet_flush),
+                      SHEETS_RECONCILE_INTERVAL="0")
+    if not args.real_limits:
+        # Поддельный API не ограничивает скорость, иначе прогон упирается в лимиты Telegram, а не в бота
+        os.environ.update(SEND_GLOBAL_RATE="1000000", SEND_CHAT_RATE="1000000", SEND_GROUP_RATE="1000000")
+    os.chdir(ROOT)
+    return tmp
+
+
+def setup(args):
+    prepare_env(args)
+    telegram = FakeTelegram(args.api_latency, args.api_429)
+    threading.Thread(target=telegram.serve_forever, daemon=True).start()
+
+    from telebot import apihelper
+    apihelper.API_URL = telegram.api_url
+
+    import bot
+    import db
+
+    writes = Recorder()
+    commits = {"commits": 0, "jobs": 0, "locked": 0}
+    original_write = db.write
+
+    def timed_write(fn, *a):
+        start = time.perf_counter()
+        try:
+            return original_write(fn, *a)
+        finally:
+            writes.add("db_write_wait", time.perf_counter() - start)
+
+    writer = db._writer
+    original_commit = writer._commit
+
+    def counted_commit(conn, batch):
+        commits["commits"] += 1
+        commits["jobs"] += len(batch)
+        original_commit(conn, batch)
+        for _, _, future in batch:
+            error = future.exception()
+            if error is not None and "locked" in str(error):
+                commits["locked"] += 1
+
+    db.write = timed_write
+    writer._commit = counted_commit
+
+    sheet_class, factory = flaky_sheet_factory(args.sheet_latency, args.sheet_429)
+    bot.sheet_writer.sheet_factory = factory
+    bot.bot.threaded = False
+    bot.start_background()
+    return telegram, bot, db, writes, commits, sheet_class
+
+
+def setup_workers(args):
+    """supervisor.py отдельным процессом: обновления он забирает через getUpdates поддельного API.
+    Таблица в этом режиме — обычный FakeSheet в процессе супервизора."""
+    tmp = prepare_env(args)
+    telegram = FakeTelegram(args.api_latency, args.api_429)
+    threading.Thread(target=telegram.serve_forever, daemon=True).start()
+    os.environ.update(BOT_API_URL=telegram.api_url, WORKER_PROCESSES=str(args.workers), METRICS_PORT="0")
+
+    log_path = os.path.join(tmp, "supervisor.log")
+    with open(log_path, "w") as log:
+        process = subprocess.Popen([sys.executable, "-u", "supervisor.py"], cwd=ROOT, stdout=log,
+                                   stderr=subprocess.STDOUT)
+    deadline = time.time() + 120
+    while True:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            if f.read().count("started, pid") >= args.workers:
+                break
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            raise SystemExit(f"supervisor.py did not start, see {log_path}")
+        time.sleep(0.1)
+    return telegram, process, log_path
+
+
+def run_users(args, texts, feed, first_order, recorder):
+    """feed(update) обрабатывает одно обновление, first_order(tg_id) — первый заказ пользователя или None."""
+    update_ids = itertools.count(1)
+    lock = threading.Lock()
+    next_user = itertools.count(0)
+    errors = []
+
+    def timed(step, update):
+        start = time.perf_counter()
+        feed(update)
+        recorder.add(step, time.perf_counter() - start)
+
+    def simulate(tg_id):
+        with lock:
+            script = Script(texts, tg_id, update_ids)
+        timed("start", script.message("/start", command=True))
+        timed("set_language", script.callback("initial_lang_en"))
+        timed("agreement", script.callback("agree_yes"))
+        for n in range(args.orders_per_user):
+            for step, update in script.order(n):
+                timed(step, update)
+        timed("my_orders", script.message(texts["main_menu_my_orders_btn"]))
+        first = first_order(tg_id)
+        if first:
+            timed("switch_order", script.callback(f"next:{first[0]}:0"))
+            timed("switch_order", script.callback(f"prev:{first[0]}:0"))
+
+    def worker():
+        while True:
+            n = next(next_user)
+            if n >= args.users:
+                return
+            try:
+                simulate(10_000_000 + n)
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, errors
+
+
+def in_process_user_api(bot, db):
+    from telebot import types
+
+    def feed(update):
+        bot.bot.process_new_updates([types.Update.de_json(update)])
+
+    def first_order(tg_id):
+        user_id, _, _ = bot.get_or_create_user(tg_id)
+        return db.first_user_order(user_id)
+
+    return feed, first_order
+
+
+def workers_user_api(telegram, conn):
+    """Пользователь ждет первого ответа в свой чат, как живой. У шагов с несколькими ответами
+    следующий шаг может уйти раньше, чем дошли все ответы предыдущего: порядок сохраняет сам бот."""
+
+    def feed(update):
+        seen = telegram.push(update)
+        if not telegram.wait_reply(raw_chat_id(update), seen, REPLY_TIMEOUT):
+            raise RuntimeError(f"no reply within {REPLY_TIMEOUT}s to {update}")
+
+    def first_order(tg_id):
+        deadline = time.time() + REPLY_TIMEOUT
+        while time.time() < deadline:
+            row = conn.execute("SELECT o.id FROM orders o JOIN users u ON o.user_id = u.id "
+                               "WHERE u.tg_id = ? ORDER BY o.id LIMIT 1", (tg_id,)).fetchone()
+            if row:
+                return row
+            time.sleep(0.01)
+        return None
+
+    return feed, first_order
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f"\ncompared with {baseline.get('revision')} ({baseline.get('timestamp')}):")
+    for name, stats in results["latency"].items():
+        old = baseline.get("latency", {}).get(name)
+        if old and old.get("p95_ms") and stats.get("p95_ms") is not None:
+            change = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            print(f"  {name:<18} p95 {old['p95_ms']:>9.2f} -> {stats['p95_ms']:>9.2f} ms ({change:+.0f}%)")
+    old, new = baseline.get("throughput", {}), results["throughput"]
+    if old.get("updates_per_s"):
+        change = (new["updates_per_s"] - old["updates_per_s"]) / old["updates_per_s"] * 100
+        print(f"  throughput {old['updates_per_s']:.0f} -> {new['updates_per_s']:.0f} updates/s ({change:+.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64, help="одновременно активных пользователей")
+    parser.add_argument("--orders-per-user", type=int, default=1)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--api-429", type=float, default=0.0, help="доля ответов 429 от Bot API")
+    parser.add_argument("--sheet-latency", type=float, default=0.2, help="задержка вызова таблицы, с")
+    parser.add_argument("--sheet-429", type=float, default=0.05, help="доля отказов таблицы по квоте")
+    parser.add_argument("--sheet-flush", type=float, default=1.0, help="SHEETS_FLUSH_INTERVAL, с")
+    parser.add_argument("--real-limits", action="store_true", help="оставить лимиты отправки из .env")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="запустить supervisor.py с этим числом процессов вместо бота в этом процессе")
+    parser.add_argument("--out", help="куда записать результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    if args.workers:
+        telegram, process, log_path = setup_workers(args)
+        import db
+        import i18n
+
+        catalog = i18n.Catalog("translations.json")
+        texts = {key: catalog.get(key, "en") for key in ("main_menu_order_btn", "main_menu_my_orders_btn")}
+        conn = db.connect(os.environ["DB_PATH"])
+        feed, first_order = workers_user_api(telegram, conn)
+        handled, errors = run_users(args, texts, feed, first_order, recorder)
+        # Ответы в этом режиме ждет сам пользователь, к концу прогона они уже доставлены
+        delivered = handled
+    else:
+        telegram, bot, db, writes, commits, sheet_class = setup(args)
+        texts = {key: bot.get_text(key, "en") for key in ("main_menu_order_btn", "main_menu_my_orders_btn")}
+        conn = db.reader()
+        feed, first_order = in_process_user_api(bot, db)
+        start = time.perf_counter()
+        handled, errors = run_users(args, texts, feed, first_order, recorder)
+        while bot.dispatcher.metrics()["queue_depth"]:
+            time.sleep(0.01)
+        delivered = time.perf_counter() - start
+
+    expected = args.users * args.orders_per_user
+    deadline = time.time() + max(30.0, args.sheet_flush * 10)
+    outbox = conn.execute("SELECT COUNT(*) FROM sheet_outbox").fetchone()[0]
+    while outbox and time.time() < deadline:
+        time.sleep(0.2)
+        outbox = conn.execute("SELECT COUNT(*) FROM sheet_outbox").fetchone()[0]
+    orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    latency = recorder.report()
+    latency["all_updates"] = percentiles([v for values in recorder.samples.values() for v in values])
+    updates = latency["all_updates"]["count"]
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": vars(args),
+        "latency": latency,
+        "throughput": {
+            "updates": updates,
+            "handled_s": round(handled, 3),
+            "delivered_s": round(delivered, 3),
+            "updates_per_s": round(updates / handled, 1),
+            "orders_per_s": round(expected / handled, 1),
+        },
+        "db": {"orders": orders},
+        "telegram": {"requests": telegram.requests, "rate_limited": telegram.rate_limited},
+        "sheets": {"outbox_left": outbox},
+        "errors": errors[:20],
+    }
+    if not args.workers:
+        # Счетчики SQLite, очереди отправки и таблицы доступны только для бота в этом процессе
+        sheet = bot.sheet_writer.sheet
+        results["db"].update({
+            "write_wait": writes.report().get("db_write_wait", {"count": 0}),
+            "commits": commits["commits"],
+            "jobs_per_commit": round(commits["jobs"] / commits["commits"], 2) if commits["commits"] else 0,
+            "locked_errors": commits["locked"],
+        })
+        results["telegram"]["dispatcher"] = bot.dispatcher.metrics()
+        results["sheets"].update({"rows": max(0, len(sheet.rows) - 1) if sheet else 0,
+                                  "calls": sheet.calls if sheet else 0, "rate_limited": sheet_class.rate_limited})
+
+    print(f"{'step':<18} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in latency.items():
+        print(f"{name:<18} {stats['count']:>7} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+    t, d, sh = results["throughput"], results["db"], results["sheets"]
+    mode = f"{args.workers} worker processes" if args.workers else "in-process"
+    print(f"\n{updates} updates from {args.users} users in {t['handled_s']}s ({mode}): {t['updates_per_s']} updates/s, "
+          f"{t['orders_per_s']} orders/s; all messages delivered after {t['delivered_s']}s")
+    if args.workers:
+        print(f"db: {d['orders']} orders")
+    else:
+        print(f"db: write wait p95 {d['write_wait'].get('p95_ms')} ms, {d['commits']} commits, "
+              f"{d['jobs_per_commit']} jobs/commit, {d['locked_errors']} 'database is locked' errors, "
+              f"{d['orders']} orders")
+    print(f"telegram: {sum(telegram.requests.values())} requests, {telegram.rate_limited} answered 429")
+    if args.workers:
+        print(f"sheets: {sh['outbox_left']} rows still in outbox")
+    else:
+        print(f"sheets: {sh['rows']}/{expected} rows in {sh['calls']} calls, "
+              f"{sh['rate_limited']} rejected by quota, {outbox} still in outbox")
+    if errors:
+        print(f"{len(errors)} users failed, first: {errors[0]}")
+    if args.workers:
+        process.terminate()
+        process.wait(10)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
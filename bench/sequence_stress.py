@@ -0,0 +1,103 @@
+"""Нагрузочная проверка выдачи номеров заявителя: несколько процессов по несколько потоков
+одновременно сохраняют заказы через db.insert_order на одну базу.
+
+    python bench/sequence_stress.py                               # счетчик на каждый заказ и блоки по 50
+    python bench/sequence_stress.py --processes 8 --threads 16 --orders 500 --block 0
+
+Проверяется, что ни одна вставка не упала, все номера уникальны и каждый номер есть в orders.
+При ошибке скрипт завершается с ненулевым кодом.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import db  # noqa: E402
+import sequences  # noqa: E402
+
+
+def run_process(index, path, threads, orders, block, results):
+    """Процесс как в supervisor.py: свой поток записи и (при block > 1) свой BlockAllocator."""
+    db.init(path)
+    allocator = sequences.BlockAllocator(db.connect(path), "applicant", block) if block > 1 else None
+    codes, failures = [], []
+    lock = threading.Lock()
+
+    def worker(n):
+        tg_id = 1_000_000 * (index + 1) + n
+        user_id = db.create_user(tg_id)
+        for i in range(orders):
+            data = {"full_name": f"Stress {index}-{n}", "phone": "+998900000000", "order_number": f"TB-{i}",
+                    "order_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+            try:
+                value = allocator.next() if allocator else None
+                code = db.insert_order(user_id, tg_id, data, "", value)
+            except Exception as e:
+                with lock:
+                    failures.append(repr(e))
+                continue
+            with lock:
+                codes.append(code)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put((codes, failures))
+
+
+def run(path, processes, threads, orders, block):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    pool = [context.Process(target=run_process, args=(i, path, threads, orders, block, results))
+            for i in range(processes)]
+    start = time.perf_counter()
+    for p in pool:
+        p.start()
+    codes, failures = [], []
+    for _ in pool:
+        process_codes, process_failures = results.get()
+        codes += process_codes
+        failures += process_failures
+    for p in pool:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    expected = processes * threads * orders
+    conn = db.connect(path)
+    stored = [row[0] for row in conn.execute("SELECT applicant_order_number FROM orders")]
+    conn.close()
+    duplicates = len(codes) - len(set(codes))
+    print(f"block={block or 1}: {len(codes)}/{expected} orders in {elapsed:.1f}s "
+          f"({len(codes) / elapsed:.0f}/s), failed {len(failures)}, duplicate codes {duplicates}")
+    for error in failures[:5]:
+        print(f"  {error}")
+    assert not failures, "failed inserts"
+    assert len(codes) == expected, "missing orders"
+    assert not duplicates, "duplicate applicant codes"
+    assert len(stored) == len(set(stored)) == expected and set(stored) == set(codes), "orders table mismatch"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--orders", type=int, default=100, help="заказов на поток")
+    parser.add_argument("--block", type=int, action="append",
+                        help="размер блока BlockAllocator; 0 — счетчик в каждой транзакции (можно несколько раз)")
+    args = parser.parse_args()
+
+    for block in args.block or [0, 50]:
+        # Каждый режим на чистой базе: номера должны сойтись с тем, что лежит в orders
+        run(os.path.join(tempfile.mkdtemp(), "stress.db"), args.processes, args.threads, args.orders, block)
+
+
+if __name__ == '__main__':
+    main()
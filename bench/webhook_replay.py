@@ -0,0 +1,139 @@
+"""Прогон записанных обновлений через webhook-сервер без обращения к Telegram.
+
+    python bench/webhook_replay.py --users 500                 # синтетические обновления, локальный сервер
+    python bench/webhook_replay.py --file updates.jsonl        # записанные обновления (по одному JSON в строке)
+    python bench/webhook_replay.py --url http://127.0.0.1:8080/webhook --secret s3cret
+
+В локальном режиме бот импортируется с временной БД, SHEETS_BACKEND=fake,
+а запросы к Bot API подменяются заглушкой.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def synthetic_updates(users):
+    """Для каждого пользователя: /start, выбор языка, согласие и кнопка «Помощь»."""
+    ids = itertools.count(1)
+
+    def user(tg_id):
+        return {"id": tg_id, "is_bot": False, "first_name": "u"}
+
+    def message(tg_id, text, command=False):
+        msg = {"message_id": next(ids), "date": 1, "chat": {"id": tg_id, "type": "private"},
+               "from": user(tg_id), "text": text}
+        if command:
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return {"update_id": next(ids), "message": msg}
+
+    def callback(tg_id, data):
+        return {"update_id": next(ids), "callback_query": {
+            "id": str(next(ids)), "chat_instance": "c", "data": data, "from": user(tg_id),
+            "message": {"message_id": next(ids), "date": 1, "chat": {"id": tg_id, "type": "private"},
+                        "from": {"id": 1, "is_bot": True, "first_name": "bot"}, "text": "x"}}}
+
+    out = []
+    for tg_id in range(10_000, 10_000 + users):
+        out += [message(tg_id, "/start", True), callback(tg_id, "initial_lang_ru"),
+                callback(tg_id, "agree_yes"), message(tg_id, "ℹ️ Помощь")]
+    return out
+
+
+def start_local_server(secret):
+    tmp = tempfile.mkdtemp()
+    os.environ.update(BOT_TOKEN="1:bench", GROUP_ID="-1", SHEETS_BACKEND="fake",
+                      DB_PATH=os.path.join(tmp, "bench.db"))
+    # Заглушка Bot API не ограничивает скорость, поэтому лимиты отправки снимаем
+    os.environ.setdefault("SEND_GLOBAL_RATE", "100000")
+    os.environ.setdefault("SEND_CHAT_RATE", "100000")
+    os.chdir(os.path.join(os.path.dirname(__file__), ".."))
+
+    from telebot import apihelper
+
+    def fake_request(token, method_name, method='get', params=None, files=None):
+        if method_name in ("sendMessage", "editMessageText"):
+            return {"message_id": 1, "date": 1, "chat": {"id": (params or {}).get("chat_id", 0), "type": "private"}}
+        return True
+
+    apihelper._make_request = fake_request
+
+    import bot
+    import webhook
+
+    bot.bot.threaded = False
+    bot.dispatcher.start()
+    updates = webhook.UpdateQueues(bot.bot.process_new_updates, bot.WEBHOOK_WORKERS, bot.WEBHOOK_QUEUE_SIZE)
+    updates.start()
+    server = webhook.WebhookServer(("127.0.0.1", 0), updates, "/webhook", secret)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/webhook", updates, bot.dispatcher
+
+
+def post_all(url, secret, payloads, concurrency):
+    parts = urlsplit(url)
+    statuses = {}
+    lock = threading.Lock()
+    chunks = [payloads[n::concurrency] for n in range(concurrency)]
+
+    def worker(chunk):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port)
+        headers = {"Content-Type": "application/json"}
+        if secret:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+        for body in chunk:
+            conn.request("POST", parts.path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            with lock:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="адрес работающего webhook-сервера; без него поднимается локальный")
+    parser.add_argument("--secret", default="bench-secret")
+    parser.add_argument("--file", help="JSONL с записанными обновлениями")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            payloads = [line.strip().encode() for line in f if line.strip()]
+    else:
+        payloads = [json.dumps(u).encode() for u in synthetic_updates(args.users)]
+
+    updates = dispatcher = None
+    url = args.url
+    if not url:
+        url, updates, dispatcher = start_local_server(args.secret)
+
+    start = time.perf_counter()
+    elapsed, statuses = post_all(url, args.secret, payloads, args.concurrency)
+    print(f"posted {len(payloads)} updates in {elapsed:.2f}s: {len(payloads) / elapsed:.0f} updates/s, statuses {statuses}")
+    if updates is not None:
+        while updates.depth() or dispatcher.metrics()["queue_depth"]:
+            time.sleep(0.01)
+        total = time.perf_counter() - start
+        print(f"processed {statuses.get(200, 0)} updates in {total:.2f}s: {statuses.get(200, 0) / total:.0f} updates/s")
+
+
+if __name__ == '__main__':
+    main()
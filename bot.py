@@ -1,95 +1,166 @@
-import json
+import functools
+import html
 import os
-import sqlite3
+import sys
+import threading
+import time
 from datetime import datetime
 
-import gspread
+_startup_t0 = time.perf_counter()
+startup_timings = []
+
+
+def mark_startup(phase):
+    """Запоминает момент окончания фазы запуска для отчета в __main__."""
+    startup_timings.append((phase, time.perf_counter()))
+
+
 import telebot
 from dotenv import load_dotenv
-from oauth2client.service_account import ServiceAccountCredentials
-from telebot import types
+from telebot import apihelper, types
 from telebot.types import ReplyKeyboardRemove
 
+import broadcast
+import cache
+import db
+import export
+import geo
+import i18n
+import metrics
+import sequences
+import search
+import sender
+import sheets
+import state
+import stats
+
+mark_startup("imports")
+
 # ---------------- ENV ----------------
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
 SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS")
 GROUP_ID = int(os.getenv("GROUP_ID"))
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_INSTANCES = int(os.getenv("WEBHOOK_INSTANCES", "1"))
+WEBHOOK_INSTANCE = int(os.getenv("WEBHOOK_INSTANCE", "0"))
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", "0.33"))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "google")
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "50"))
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "5"))
+SHEETS_RECONCILE_INTERVAL = float(os.getenv("SHEETS_RECONCILE_INTERVAL", "3600"))
+SEQUENCE_BLOCK = int(os.getenv("SEQUENCE_BLOCK", "1"))
+DB_PATH = os.getenv("DB_PATH", "new_orders.db")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "600"))
+STATE_TTL = float(os.getenv("STATE_TTL", "86400"))
+STATE_MAX_ITEMS = int(os.getenv("STATE_MAX_ITEMS", "10000"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9812"))
+SLOW_CALL_MS = float(os.getenv("SLOW_CALL_MS", "500"))
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "4"))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "8"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+BOT_API_URL = os.getenv("BOT_API_URL")
+
+# Несколько экземпляров webhook за балансировщиком: обновления чата приходят в любой из них,
+# поэтому кеши пользователей и состояний в памяти процесса разошлись бы — читаем только SQLite.
+# Лимиты Telegram общие на бота: каждому экземпляру — своя доля, как воркерам supervisor.py
+if BOT_MODE == "webhook" and WEBHOOK_INSTANCES > 1:
+    USER_CACHE_SIZE = STATE_MAX_ITEMS = 0
+    SEND_GLOBAL_RATE /= WEBHOOK_INSTANCES
+    SEND_GROUP_RATE /= WEBHOOK_INSTANCES
+    BROADCAST_RATE /= WEBHOOK_INSTANCES
 
 ADMIN_IDS = ['без кавычек с запятыми список ']
 
+# Замеры обработчиков, Bot API, таблицы и SQL; METRICS_PORT=0 отключает их полностью
+if METRICS_PORT:
+    metrics.registry.slow_threshold = SLOW_CALL_MS / 1000
+    metrics.instrument_telegram()
+    db.connection_factory = metrics.TimedConnection
+
+# Свой сервер Bot API (telegram-bot-api) вместо api.telegram.org, формат https://host/bot{0}/{1}
+if BOT_API_URL:
+    apihelper.API_URL = BOT_API_URL
+
 bot = telebot.TeleBot(TOKEN, parse_mode="HTML")
+# Все исходящие сообщения и правки идут через очередь с ограничением скорости и повтором при 429
+dispatcher = sender.Dispatcher(bot, SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_GROUP_RATE,
+                               group_ids={GROUP_ID}, workers=SEND_WORKERS)
+mark_startup("env")
 
 # ---------------- Translations ----------------
-with open('translations.json', 'r', encoding='utf-8') as f:
-    LANG_TEXT = json.load(f)
+# Каталог проверяется при загрузке: без полного набора переводов бот не запустится
+catalog = i18n.Catalog('translations.json')
 
 
 def get_text(key, lang_code='ru'):
-    """Получает текст из JSON по ключу и языку."""
-    return LANG_TEXT.get(key, {}).get(lang_code, f"NO_TRANSLATION_FOR_{key}")
+    """Получает текст из каталога по ключу и языку."""
+    return catalog.get(key, lang_code)
+
+
+mark_startup("translations")
 
 
 # ---------------- DB ----------------
-conn = sqlite3.connect("new_orders.db", check_same_thread=False)
-cursor = conn.cursor()
-
-# Таблица пользователей: добавлено поле языка
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    tg_id INTEGER UNIQUE,
-    agreed INTEGER DEFAULT 0,
-    language_code TEXT DEFAULT 'ru'
-)
-""")
-
-# Таблица заказов: без изменений
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS orders (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    full_name TEXT,
-    phone TEXT,
-    order_number TEXT,
-    order_date TEXT,
-    latitude REAL,
-    longitude REAL,
-    applicant_order_number TEXT UNIQUE,
-    location TEXT,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-)
-""")
-conn.commit()
+db.init(DB_PATH)
 
-# ---------------- Google Sheets ----------------
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-client = gspread.authorize(creds)
-sheet = client.open_by_key(SHEET_ID).sheet1
+# Номера заявителя выдаются счетчиком из таблицы sequences; при SEQUENCE_BLOCK > 1 — блоками
+applicant_allocator = None
+if SEQUENCE_BLOCK > 1:
+    applicant_allocator = sequences.BlockAllocator(db.connect(DB_PATH), "applicant", SEQUENCE_BLOCK)
 
-if len(sheet.get_all_values()) == 0:
-    sheet.append_row([
-        "Telegram ID", "ФИО", "Телефон",
-        "Номер заказа (Taobao)", "Дата заказа",
-        "Локация", "Номер заказа заявителя"
-    ])
+# Профили пользователей читаются почти в каждом обработчике — держим их в памяти
+user_cache = cache.UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+mark_startup("db")
 
-# ---------------- Временные данные ----------------
-user_data = {}
+# ---------------- Google Sheets ----------------
+# Лист открывается лениво в фоновом потоке: запуск бота не ждет авторизации в Google.
+# Строки заказов уходят в таблицу тем же потоком, пользователь не ждет ответа Google
+if SHEETS_BACKEND == "fake":
+    sheet_writer = sheets.SheetWriter(DB_PATH, sheets.FakeSheet, batch_size=SHEETS_BATCH_SIZE,
+                                      flush_interval=SHEETS_FLUSH_INTERVAL,
+                                      reconcile_interval=SHEETS_RECONCILE_INTERVAL)
+else:
+    sheet_writer = sheets.SheetWriter(DB_PATH, lambda: sheets.open_google_sheet(CREDENTIALS_FILE, SHEET_ID),
+                                      sheet_key=SHEET_ID, batch_size=SHEETS_BATCH_SIZE,
+                                      flush_interval=SHEETS_FLUSH_INTERVAL,
+                                      reconcile_interval=SHEETS_RECONCILE_INTERVAL)
+
+if METRICS_PORT:
+    sheet_writer.sheet_factory = metrics.timed_sheet_factory(sheet_writer.sheet_factory)
+
+# ---------------- Состояния диалогов ----------------
+# Шаги оформления заказа и просмотра заказов хранятся в SQLite и переживают перезапуск
+conversations = state.StateStore(STATE_TTL, STATE_MAX_ITEMS)
 
 
 def get_or_create_user(tg_id):
     """Возвращает ID, статус согласия и язык. Если пользователя нет, создает его."""
-    cursor.execute("SELECT id, agreed, language_code FROM users WHERE tg_id = ?", (tg_id,))
-    row = cursor.fetchone()
+    row = user_cache.get(tg_id)
+    if row is None:
+        row = db.get_user(tg_id)
+        if row:
+            user_cache.put(tg_id, row)
     if row:
         return row[0], row[1], row[2]  # user_id, agreed_status, lang_code
     else:
-        cursor.execute("INSERT INTO users (tg_id, agreed) VALUES (?, ?)", (tg_id, 0))
-        conn.commit()
-        return cursor.lastrowid, 0, None
+        user_id = db.create_user(tg_id)
+        # В БД язык по умолчанию 'ru', но первый ответ остается None, чтобы показать выбор языка
+        user_cache.put(tg_id, (user_id, 0, 'ru'))
+        return user_id, 0, None
 
 
 def get_location_link(latitude, longitude, lang):
@@ -100,39 +171,104 @@ def get_location_link(latitude, longitude, lang):
     return f"\n{map_link} | {map_link2}"
 
 
-def main_menu(chat_id, lang):
+@functools.lru_cache(maxsize=None)
+def main_menu_keyboard(lang, is_admin):
     kb = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
     kb.add(get_text("main_menu_order_btn", lang))
     kb.add(get_text("main_menu_my_orders_btn", lang), get_text("main_menu_help_btn", lang))
     kb.add(get_text("main_menu_settings_btn", lang))
-    if chat_id in ADMIN_IDS:
+    if is_admin:
         kb.add(get_text("admin_order_info_btn", lang), get_text("admin_stats_btn", lang))
-    bot.send_message(chat_id, get_text("main_menu_title", lang), reply_markup=kb)
+    return kb
+
+
+def language_keyboard(prefix, lang=None):
+    """Выбор языка: prefix задает callback_data (initial_lang_ или change_lang_), lang — кнопку «Назад»."""
+    kb = types.InlineKeyboardMarkup(row_width=1)
+    kb.add(
+        types.InlineKeyboardButton("🇷🇺 Русский", callback_data=f"{prefix}ru"),
+        types.InlineKeyboardButton("🇬🇧 English", callback_data=f"{prefix}en"),
+        types.InlineKeyboardButton("🇺🇿 O'zbekcha", callback_data=f"{prefix}uz")
+    )
+    if lang:
+        kb.add(types.InlineKeyboardButton(get_text("back_btn", lang), callback_data="back_to_main"))
+    return kb
+
+
+def yes_no_keyboard(lang, yes_key, no_key, prefix):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(get_text(yes_key, lang), callback_data=f"{prefix}_yes"))
+    markup.add(types.InlineKeyboardButton(get_text(no_key, lang), callback_data=f"{prefix}_no"))
+    return markup
+
+
+def orders_keyboard(lang, order_id, index):
+    kb = types.InlineKeyboardMarkup()
+    kb.add(
+        types.InlineKeyboardButton(get_text("prev_btn", lang), callback_data=f"prev:{order_id}:{index}"),
+        types.InlineKeyboardButton(get_text("next_btn", lang), callback_data=f"next:{order_id}:{index}")
+    )
+    return kb
+
+
+def search_keyboard(lang, page, pages):
+    kb = types.InlineKeyboardMarkup()
+    buttons = []
+    if page > 0:
+        buttons.append(types.InlineKeyboardButton(get_text("prev_btn", lang), callback_data=f"search:{page - 1}"))
+    if page + 1 < pages:
+        buttons.append(types.InlineKeyboardButton(get_text("next_btn", lang), callback_data=f"search:{page + 1}"))
+    if not buttons:
+        return None
+    kb.add(*buttons)
+    return kb
+
+
+def location_keyboard(lang):
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.add(types.KeyboardButton(get_text("location_share_btn", lang), request_location=True))
+    return markup
+
+
+def address_text(lang, user_id):
+    return (
+        f"📍 Филиал в Китае: \n\n"
+        f"Warehouse 55055, No. B7, No. 101 Zhanqian Road, Liwan District, Guangzhou, Niuyun Hengtong Logistics 13178855505\n\n"
+        f"广州市荔湾区站前路101号B7号5505库房牛运亨通物流13178855505\n\n"
+        f"{get_text('address_prompt', lang).format(user_id=user_id)}"
+    )
+
+
+def main_menu(chat_id, lang):
+    dispatcher.send_message(chat_id, get_text("main_menu_title", lang),
+                            reply_markup=main_menu_keyboard(lang, chat_id in ADMIN_IDS))
+
+
+@bot.message_handler(func=lambda m: conversations.get(m.chat.id)[0] in STEP_HANDLERS,
+                     content_types=telebot.util.content_type_media)
+def handle_step(message):
+    """Передает сообщение текущему шагу сценария, как это делал register_next_step_handler."""
+    step, data = conversations.get(message.chat.id)
+    _, _, lang = get_or_create_user(message.from_user.id)
+    STEP_HANDLERS[step](message, lang, data)
 
 
 @bot.message_handler(commands=['start'])
 def start(message):
     user_id, agreed, lang = get_or_create_user(message.from_user.id)
+    db.set_unblocked(message.from_user.id)
 
     if not lang:
-        kb = types.InlineKeyboardMarkup(row_width=1)
         # <<< ИЗМЕНЕНИЕ 1: Меняем callback_data для ПЕРВОНАЧАЛЬНОЙ установки
-        kb.add(
-            types.InlineKeyboardButton("🇷🇺 Русский", callback_data="initial_lang_ru"),
-            types.InlineKeyboardButton("🇬🇧 English", callback_data="initial_lang_en"),
-            types.InlineKeyboardButton("🇺🇿 O'zbekcha", callback_data="initial_lang_uz")
-        )
-        bot.send_message(message.chat.id, get_text('choose_language', 'ru'),
-                         reply_markup=kb)
+        dispatcher.send_message(message.chat.id, get_text('choose_language', 'ru'),
+                                reply_markup=language_keyboard("initial_lang_"))
         return
 
     if agreed:
         main_menu(message.chat.id, lang)
     else:
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(get_text("agree_yes_btn", lang), callback_data="agree_yes"))
-        markup.add(types.InlineKeyboardButton(get_text("agree_no_btn", lang), callback_data="agree_no"))
-        bot.send_message(
+        markup = yes_no_keyboard(lang, "agree_yes_btn", "agree_no_btn", "agree")
+        dispatcher.send_message(
             message.chat.id,
             get_text("agreement_prompt", lang),
             reply_markup=markup, parse_mode="HTML", disable_web_page_preview=True
@@ -142,10 +278,10 @@ def start(message):
 @bot.callback_query_handler(func=lambda call: call.data.startswith("initial_lang_"))
 def initial_set_language(call):
     lang_code = call.data.split("_")[-1]
-    cursor.execute("UPDATE users SET language_code = ? WHERE tg_id = ?", (lang_code, call.from_user.id))
-    conn.commit()
+    db.set_language(call.from_user.id, lang_code)
+    user_cache.update(call.from_user.id, language_code=lang_code)
     bot.answer_callback_query(call.id, get_text("language_selected", lang_code))
-    bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+    dispatcher.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
     # Вызываем start, чтобы продолжить регистрацию (показать соглашение)
     start(call.message)
 
@@ -153,10 +289,10 @@ def initial_set_language(call):
 @bot.callback_query_handler(func=lambda call: call.data.startswith("change_lang_"))
 def change_language_from_settings(call):
     lang_code = call.data.split("_")[-1]
-    cursor.execute("UPDATE users SET language_code = ? WHERE tg_id = ?", (lang_code, call.from_user.id))
-    conn.commit()
+    db.set_language(call.from_user.id, lang_code)
+    user_cache.update(call.from_user.id, language_code=lang_code)
     bot.answer_callback_query(call.id, get_text("language_selected", lang_code))
-    bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+    dispatcher.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
     main_menu(call.message.chat.id, lang_code)
 
 
@@ -165,15 +301,15 @@ def handle_agreement(call):
     _, _, lang = get_or_create_user(call.from_user.id)
     bot.answer_callback_query(call.id)
     if call.data == "agree_no":
-        bot.edit_message_text(
+        dispatcher.edit_message_text(
             get_text("agree_no_reply", lang),
             chat_id=call.message.chat.id,
             message_id=call.message.message_id
         )
     else:
-        cursor.execute("UPDATE users SET agreed = 1 WHERE tg_id = ?", (call.from_user.id,))
-        conn.commit()
-        bot.edit_message_text(
+        db.set_agreed(call.from_user.id)
+        user_cache.update(call.from_user.id, agreed=1)
+        dispatcher.edit_message_text(
             get_text("agree_thanks", lang),
             chat_id=call.message.chat.id,
             message_id=call.message.message_id
@@ -182,196 +318,375 @@ def handle_agreement(call):
 
 
 # ---------------- Главное меню ----------------
-@bot.message_handler(func=lambda m: True)
+@bot.message_handler(func=lambda m: not telebot.util.is_command(m.text or ""))
 def handle_text(message):
     _, _, lang = get_or_create_user(message.from_user.id)
 
-    if message.text == get_text("main_menu_order_btn", lang):
-        order_start(message, lang)
-    elif message.text == get_text("main_menu_my_orders_btn", lang):
-        my_orders(message, lang)
-    elif message.text == get_text("admin_stats_btn", lang) and message.chat.id in ADMIN_IDS:
-        get_stats(message, lang)
-    elif message.text == get_text("admin_order_info_btn", lang) and message.chat.id in ADMIN_IDS:
-        get_order_info_start(message, lang)
-    elif message.text == get_text("main_menu_help_btn", lang):
-        help_message(message, lang)
-    elif message.text == get_text("main_menu_settings_btn", lang):
-        show_settings(message, lang)
+    action = catalog.action(lang, message.text)
+    if action is None or (action in ADMIN_ACTIONS and message.chat.id not in ADMIN_IDS):
+        return
+    MENU_HANDLERS[action](message, lang)
 
 
 def show_settings(message, lang):
-    kb = types.InlineKeyboardMarkup(row_width=1)
     # <<< ИЗМЕНЕНИЕ 4: Меняем callback_data для смены языка
-    kb.add(
-        types.InlineKeyboardButton("🇷🇺 Русский", callback_data="change_lang_ru"),
-        types.InlineKeyboardButton("🇬🇧 English", callback_data="change_lang_en"),
-        types.InlineKeyboardButton("🇺🇿 O'zbekcha", callback_data="change_lang_uz"),
-        types.InlineKeyboardButton(get_text("back_btn", lang), callback_data="back_to_main")
-    )
-    bot.send_message(message.chat.id, get_text('settings_menu_title', lang), reply_markup=kb)
+    dispatcher.send_message(message.chat.id, get_text('settings_menu_title', lang),
+                            reply_markup=language_keyboard("change_lang_", lang))
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "back_to_main")
 def back_to_main_handler(call):
     bot.answer_callback_query(call.id)
-    bot.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
+    dispatcher.delete_message(chat_id=call.message.chat.id, message_id=call.message.message_id)
 
 
 def order_start(message, lang):
-    user_data[message.chat.id] = {}
-    bot.send_message(message.chat.id, get_text("get_name_prompt", lang))
-    bot.register_next_step_handler(message, get_name, lang)
+    conversations.set(message.chat.id, "name", {})
+    dispatcher.send_message(message.chat.id, get_text("get_name_prompt", lang))
 
 
 def my_orders(message, lang):
-    tg_id = message.from_user.id
-    cursor.execute(
-        """
-        SELECT o.applicant_order_number, o.full_name, o.phone, o.order_number, o.order_date, o.latitude, o.longitude
-        FROM orders o JOIN users u ON o.user_id = u.id
-        WHERE u.tg_id = ? ORDER BY o.id
-        """, (tg_id,)
-    )
-    orders = cursor.fetchall()
-    if not orders:
-        bot.send_message(message.chat.id, get_text("no_orders", lang))
+    user_id, _, _ = get_or_create_user(message.from_user.id)
+    order = db.first_user_order(user_id)
+    if not order:
+        dispatcher.send_message(message.chat.id, get_text("no_orders", lang))
         return
-    user_data[tg_id] = {'orders': orders, 'current_index': 0}
-    send_order_message(message.chat.id, tg_id, lang, new_message=True)
+    send_order_message(message.chat.id, lang, order, 0, db.count_user_orders(user_id))
 
 
-def send_order_message(chat_id, tg_id, lang, new_message=False):
-    orders_info = user_data.get(tg_id)
-    if not orders_info:
-        bot.send_message(chat_id, get_text("order_info_error", lang))
+def send_order_message(chat_id, lang, order, index, total_orders, message_id=None):
+    """Показывает один заказ. Позиция и id заказа зашиты в callback_data кнопок,
+    поэтому перелистывание не хранит список заказов ни в памяти, ни в состоянии."""
+    text = catalog.render(
+        "order_card", lang, index=index + 1, total=total_orders, code=order[1], full_name=order[2],
+        phone=order[3], order_number=order[4], order_date=order[5],
+        location=get_location_link(order[6], order[7], lang)
+    )
+    kb = orders_keyboard(lang, order[0], index)
+    if message_id is None:
+        dispatcher.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML", disable_web_page_preview=True)
         return
 
-    index = orders_info['current_index']
-    order = orders_info['orders'][index]
-    total_orders = len(orders_info['orders'])
-
-    location_links = get_location_link(order[5], order[6], lang)
-    text = (
-        f"📋 {get_text('order_x_of_y', lang).format(index=index + 1, total=total_orders)}\n\n"
-        f"{get_text('your_order_number', lang)}: {order[0]}\n"
-        f"👤 {get_text('full_name_label', lang)}: {order[1]}\n"
-        f"📞 {get_text('phone_label', lang)}: {order[2]}\n"
-        f"📦 {get_text('taobao_order_num_label', lang)}: {order[3]}\n"
-        f"📅 {get_text('date_label', lang)}: {order[4]}\n"
-        f"📍 {get_text('location_label', lang)}: {location_links}"
-    )
-    kb = types.InlineKeyboardMarkup()
-    kb.add(
-        types.InlineKeyboardButton(get_text("prev_btn", lang), callback_data="prev"),
-        types.InlineKeyboardButton(get_text("next_btn", lang), callback_data="next")
-    )
-    try:
-        if new_message:
-            sent_message = bot.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML",
-                                            disable_web_page_preview=True)
-            user_data[tg_id]['message_id'] = sent_message.message_id
-        else:
-            bot.edit_message_text(text, chat_id=chat_id, message_id=orders_info['message_id'],
-                                  parse_mode="HTML", disable_web_page_preview=True, reply_markup=kb)
-    except Exception as e:
-        print(f"Error sending order message: {e}")
-        sent_message = bot.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML",
-                                        disable_web_page_preview=True)
-        user_data[tg_id]['message_id'] = sent_message.message_id
+    def resend_on_error(future):
+        if future.exception() is not None:
+            print(f"Error sending order message: {future.exception()}")
+            dispatcher.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML", disable_web_page_preview=True)
 
+    dispatcher.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode="HTML",
+                                 disable_web_page_preview=True, reply_markup=kb).add_done_callback(resend_on_error)
 
-@bot.callback_query_handler(func=lambda call: call.data in ["prev", "next"])
+
+@bot.callback_query_handler(func=lambda call: call.data.split(":")[0] in ["prev", "next"])
 def switch_order(call):
-    _, _, lang = get_or_create_user(call.from_user.id)
-    orders_info = user_data.get(call.from_user.id)
+    user_id, _, lang = get_or_create_user(call.from_user.id)
+    parts = call.data.split(":")
+    total_orders = db.count_user_orders(user_id)
 
-    if not orders_info:
+    # Кнопки старого формата ("prev"/"next" без курсора) больше не поддерживаются
+    if len(parts) != 3 or not total_orders:
         bot.answer_callback_query(call.id, get_text("order_info_error", lang), show_alert=True)
         return
 
-    current_index = orders_info['current_index']
-    total_orders = len(orders_info['orders'])
-    if call.data == "prev":
-        orders_info['current_index'] = (current_index - 1 + total_orders) % total_orders
-    elif call.data == "next":
-        orders_info['current_index'] = (current_index + 1) % total_orders
-
+    order, index = neighbour_order(user_id, parts[0], int(parts[1]), int(parts[2]), total_orders)
     bot.answer_callback_query(call.id)
-    send_order_message(call.message.chat.id, call.from_user.id, lang)
+    send_order_message(call.message.chat.id, lang, order, index, total_orders,
+                       message_id=call.message.message_id)
+
+
+def neighbour_order(user_id, direction, order_id, index, total_orders):
+    """Соседний заказ по id с переходом через край списка; возвращает (order, index)."""
+    if direction == "prev":
+        order = db.user_order_before(user_id, order_id)
+        index = index - 1
+        if order is None:
+            order, index = db.last_user_order(user_id), total_orders - 1
+    else:
+        order = db.user_order_after(user_id, order_id)
+        index = index + 1
+        if order is None:
+            order, index = db.first_user_order(user_id), 0
+    return order, index % total_orders
 
 
 # ---------------- Admin Functions ----------------
+FUNNEL_LABELS = {
+    "get_name": "full_name_label",
+    "get_phone": "phone_label",
+    "get_order_number": "taobao_order_num_label",
+    "get_location": "location_label",
+    "final_save": "stats_funnel_saved",
+}
+
+
+def stats_text(lang):
+    """Панель статистики из готовых счетчиков (см. stats.py)."""
+    d = db.get_dashboard()
+    rate = round(100 * d["agreed"] / d["users"], 1) if d["users"] else 0
+    lines = [
+        get_text("stats_message", lang).format(count=d["users"]),
+        get_text("stats_agreed", lang).format(agreed=d["agreed"], rate=rate),
+        get_text("stats_orders", lang).format(orders=d["orders"]),
+        "",
+        get_text("stats_orders_by_day", lang),
+    ]
+    lines += [f"  {day}: <b>{count}</b>" for day, count in d["days"]]
+    lines += ["", get_text("stats_orders_by_language", lang)]
+    lines += [f"  {code or '—'}: <b>{count}</b>" for code, count in d["languages"]]
+    lines += ["", get_text("stats_funnel", lang)]
+    first = d["funnel"].get(stats.FUNNEL[0][1], 0)
+    for _, stage in stats.FUNNEL:
+        count = d["funnel"].get(stage, 0)
+        share = f" ({round(100 * count / first)}%)" if first else ""
+        lines.append(f"  {get_text(FUNNEL_LABELS[stage], lang)}: <b>{count}</b>{share}")
+    if d["top"]:
+        lines += ["", get_text("stats_top_customers", lang)]
+        lines += [f"  <code>{tg_id}</code>: <b>{count}</b>" for tg_id, count in d["top"]]
+    return "\n".join(lines)
+
+
 def get_stats(message, lang):
-    cursor.execute("SELECT COUNT(id) FROM users")
-    count = cursor.fetchone()[0]
-    bot.send_message(message.chat.id, get_text("stats_message", lang).format(count=count))
+    dispatcher.send_message(message.chat.id, stats_text(lang))
 
 
 def get_order_info_start(message, lang):
-    bot.send_message(message.chat.id, get_text("admin_find_order_prompt", lang))
-    bot.register_next_step_handler(message, find_order_by_applicant_number, lang)
+    conversations.set(message.chat.id, "admin_find", {})
+    dispatcher.send_message(message.chat.id, get_text("admin_find_order_prompt", lang))
 
 
-def find_order_by_applicant_number(message, lang):
-    applicant_order_number = message.text.strip()
-    cursor.execute("""
-        SELECT o.applicant_order_number, o.full_name, o.phone, o.order_number, o.order_date, o.location, u.tg_id
-        FROM orders o JOIN users u ON o.user_id = u.id
-        WHERE o.applicant_order_number = ?
-    """, (applicant_order_number,))
-    order = cursor.fetchone()
+def find_order_by_applicant_number(message, lang, data=None):
+    conversations.clear(message.chat.id)
+    applicant_order_number = (message.text or "").strip()
+    order = db.find_order(applicant_order_number)
 
     if not order:
-        bot.send_message(message.chat.id, get_text("admin_order_not_found", lang).format(number=applicant_order_number))
+        # Точного совпадения нет — ищем по ФИО, телефону и номерам
+        text = search_results_text(applicant_order_number, lang, 0)
+        if text is None:
+            dispatcher.send_message(message.chat.id, get_text("admin_order_not_found", lang).format(number=applicant_order_number))
+            return
+        conversations.set(message.chat.id, "results", {"query": applicant_order_number}, flow="search")
+        dispatcher.send_message(message.chat.id, text[0], reply_markup=text[1], disable_web_page_preview=True)
         return
 
-    text = (
-        f"{get_text('admin_order_found_title', lang).format(number=order[0])}\n\n"
-        f"{get_text('admin_user_data_label', lang)}\n"
-        f"👤 {get_text('full_name_label', lang)}: {order[1]}\n"
-        f"📞 {get_text('phone_label', lang)}: {order[2]}\n"
-        f"💬 Telegram ID: <code>{order[6]}</code> (<a href='tg://user?id={order[6]}'>{get_text('admin_open_chat_link', lang)}</a>)\n\n"
-        f"{get_text('admin_order_data_label', lang)}\n"
-        f"📦 {get_text('taobao_order_num_label', lang)}: {order[3]}\n"
-        f"📅 {get_text('date_label', lang)}: {order[4]}\n"
-        f"📍 {get_text('location_label', lang)}: {order[5]}"
+    text = catalog.render(
+        "admin_order", lang, number=order[0], full_name=order[1], phone=order[2], tg_id=order[6],
+        order_number=order[3], order_date=order[4], location=order[5]
     )
-    bot.send_message(message.chat.id, text, disable_web_page_preview=True)
+    dispatcher.send_message(message.chat.id, text, disable_web_page_preview=True)
+
+
+def search_results_text(query, lang, page):
+    """Текст и клавиатура страницы результатов поиска или None, если ничего не найдено."""
+    rows, total = db.search_orders(query, page)
+    if not rows:
+        return None
+    pages = -(-total // search.PAGE_SIZE)
+    lines = [get_text("admin_search_results", lang).format(
+        total=f"{total}+" if total >= search.MAX_CANDIDATES else total, page=page + 1, pages=pages
+    )]
+    for code, full_name, phone, order_number, order_date in rows:
+        lines.append(f"\n<code>{code}</code> · {html.escape(full_name or '')}\n📞 {html.escape(phone or '')} · "
+                     f"📦 {html.escape(order_number or '')} · 📅 {order_date}")
+    return "\n".join(lines), search_keyboard(lang, page, pages)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("search:") and call.message.chat.id in ADMIN_IDS)
+def switch_search_page(call):
+    _, _, lang = get_or_create_user(call.from_user.id)
+    _, data = conversations.get(call.message.chat.id, flow="search")
+    text = search_results_text(data["query"], lang, int(call.data.split(":")[1])) if data else None
+    if text is None:
+        bot.answer_callback_query(call.id, get_text("order_info_error", lang), show_alert=True)
+        return
+    bot.answer_callback_query(call.id)
+    dispatcher.edit_message_text(text[0], chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                 reply_markup=text[1], disable_web_page_preview=True)
+
+
+@bot.message_handler(commands=['broadcast'], func=lambda m: m.chat.id in ADMIN_IDS)
+def broadcast_start(message):
+    _, _, lang = get_or_create_user(message.from_user.id)
+    conversations.set(message.chat.id, "broadcast_text", {})
+    dispatcher.send_message(message.chat.id, get_text("admin_broadcast_prompt", lang))
+
+
+def broadcast_text(message, lang, data=None):
+    conversations.clear(message.chat.id)
+    if not message.text:
+        return
+    broadcast_id = broadcaster.start(message.text, message.chat.id, lang)
+    dispatcher.send_message(message.chat.id, get_text("admin_broadcast_started", lang).format(id=broadcast_id))
+
+
+def broadcast_done(broadcast_id, admin_chat_id, admin_lang, totals):
+    if admin_chat_id:
+        dispatcher.send_message(admin_chat_id, get_text("admin_broadcast_done", admin_lang).format(id=broadcast_id, **totals))
+
+
+@bot.message_handler(commands=['export'], func=lambda m: m.chat.id in ADMIN_IDS)
+def export_orders(message):
+    _, _, lang = get_or_create_user(message.from_user.id)
+    filters = export.parse_filters(telebot.util.extract_arguments(message.text).split())
+    if filters is None:
+        dispatcher.send_message(message.chat.id, get_text("admin_export_usage", lang))
+        return
+    if filters["fmt"] == "xlsx" and not export.xlsx_available():
+        dispatcher.send_message(message.chat.id, get_text("admin_export_no_xlsx", lang))
+        filters["fmt"] = "csv"
+    dispatcher.send_message(message.chat.id, get_text("admin_export_started", lang))
+    threading.Thread(target=send_export, args=(message.chat.id, lang, filters), name="export", daemon=True).start()
+
+
+def send_export(chat_id, lang, filters):
+    """Пишет выгрузку в фоне и отправляет файл; временный файл удаляется после отправки."""
+    try:
+        path, count = export.write_export(**filters)
+    except Exception as e:
+        print(f"Export error: {e}")
+        dispatcher.send_message(chat_id, get_text("order_info_error", lang))
+        return
+    if not count:
+        os.remove(path)
+        dispatcher.send_message(chat_id, get_text("admin_export_empty", lang))
+        return
+    document = open(path, "rb")
+
+    def cleanup(future):
+        document.close()
+        os.remove(path)
+
+    dispatcher.send_document(
+        chat_id, document, caption=get_text("admin_export_done", lang).format(count=count),
+        visible_file_name=export.file_name(**filters)
+    ).add_done_callback(cleanup)
+
+
+@bot.message_handler(commands=['status'], func=lambda m: m.chat.id in ADMIN_IDS)
+def change_order_status(message):
+    _, _, lang = get_or_create_user(message.from_user.id)
+    args = telebot.util.extract_arguments(message.text).split(maxsplit=1)
+    if len(args) != 2:
+        dispatcher.send_message(message.chat.id, get_text("admin_status_usage", lang))
+        return
+    number, status = args
+    if db.set_order_status(number, status):
+        dispatcher.send_message(message.chat.id, get_text("admin_status_updated", lang).format(
+            number=html.escape(number), status=html.escape(status)))
+    else:
+        dispatcher.send_message(message.chat.id, get_text("admin_order_not_found", lang).format(number=html.escape(number)))
+
+
+@bot.message_handler(commands=['near'], func=lambda m: m.chat.id in ADMIN_IDS)
+def near_start(message):
+    _, _, lang = get_or_create_user(message.from_user.id)
+    filters = geo.parse_near_args(telebot.util.extract_arguments(message.text).split())
+    if filters is None:
+        dispatcher.send_message(message.chat.id, get_text("admin_near_usage", lang))
+        return
+    conversations.set(message.chat.id, "near_point", filters)
+    dispatcher.send_message(message.chat.id, get_text("admin_near_prompt", lang).format(
+        radius=f"{filters['radius_km']:g}", status=html.escape(filters["status"])), reply_markup=location_keyboard(lang))
+
+
+def near_point(message, lang, data):
+    """Точка для /near: локация или координаты текстом."""
+    conversations.clear(message.chat.id)
+    if message.location:
+        point = (message.location.latitude, message.location.longitude)
+    else:
+        point = geo.parse_point(message.text)
+    if point is None:
+        dispatcher.send_message(message.chat.id, get_text("admin_near_no_point", lang), reply_markup=ReplyKeyboardRemove())
+        return
+    dispatcher.send_message(message.chat.id, near_text(*point, data["radius_km"], data["status"], lang),
+                            reply_markup=ReplyKeyboardRemove(), disable_web_page_preview=True)
+
+
+def near_text(latitude, longitude, radius_km, status, lang):
+    rows, total = db.near_orders(latitude, longitude, radius_km, status)
+    radius = f"{radius_km:g}"
+    if not rows:
+        return get_text("admin_near_empty", lang).format(radius=radius, status=html.escape(status))
+    lines = [get_text("admin_near_results", lang).format(radius=radius, status=html.escape(status), total=total)]
+    item = get_text("admin_near_item", lang)
+    for distance, code, full_name, phone, lat, lon in rows:
+        lines.append("\n" + item.format(code=code, distance=f"{distance:.1f}", full_name=html.escape(full_name or ""),
+                                        phone=html.escape(phone or ""), map=geo.map_url(lat, lon)))
+    if total > len(rows):
+        lines.append("\n" + get_text("admin_list_more", lang).format(count=total - len(rows)))
+    return "\n".join(lines)
+
+
+@bot.message_handler(commands=['zones'], func=lambda m: m.chat.id in ADMIN_IDS)
+def delivery_zones(message):
+    _, _, lang = get_or_create_user(message.from_user.id)
+    filters = geo.parse_zone_args(telebot.util.extract_arguments(message.text).split())
+    if filters is None:
+        dispatcher.send_message(message.chat.id, get_text("admin_zones_usage", lang))
+        return
+    dispatcher.send_message(message.chat.id, zones_text(lang, **filters), disable_web_page_preview=True)
+
+
+def zones_text(lang, day, radius_km, status=None):
+    zones = db.order_zones(day, radius_km, status)
+    if not zones:
+        return get_text("admin_zones_empty", lang).format(day=day.isoformat())
+    lines = [get_text("admin_zones_results", lang).format(
+        day=day.isoformat(), total=sum(zone[0] for zone in zones), radius=f"{radius_km:g}", zones=len(zones)
+    )]
+    item, more = get_text("admin_zones_item", lang), get_text("admin_list_more", lang)
+    for n, (count, lat, lon, codes) in enumerate(zones[:geo.ZONES_SHOWN], start=1):
+        shown = ", ".join(codes[:geo.ZONE_CODES_SHOWN])
+        if count > geo.ZONE_CODES_SHOWN:
+            shown += " " + more.format(count=count - geo.ZONE_CODES_SHOWN)
+        lines.append("\n" + item.format(n=n, count=count, map=geo.map_url(lat, lon), codes=shown))
+    if len(zones) > geo.ZONES_SHOWN:
+        lines.append("\n" + more.format(count=len(zones) - geo.ZONES_SHOWN))
+    return "\n".join(lines)
 
 
 def help_message(message, lang):
-    bot.send_message(message.chat.id, get_text("help_text", lang))
+    dispatcher.send_message(message.chat.id, get_text("help_text", lang))
 
 
 # ---------------- ORDERING PROCESS ----------------
-def get_name(message, lang):
-    full_name = message.text.strip()
+# Уведомление для группы администраторов всегда на русском
+GROUP_ORDER_TEMPLATE = (
+    "🆕 <b>Новый заказ!</b>\n\n"
+    "Номер заказа заявителя: <code>{code}</code>\n"
+    "Уникальный ID: <code>{user_id}</code>\n\n"
+    "<b>Клиент:</b>\n"
+    "👤 {full_name}\n"
+    "📞 {phone}\n"
+    "🆔 <a href='tg://user?id={tg_id}'>{tg_id}</a>\n\n"
+    "<b>Заказ:</b>\n"
+    "📦 Taobao №: {order_number}\n"
+    "📅 Дата: {order_date}\n"
+    "📍 Локация: {location}"
+)
+
+
+def get_name(message, lang, data):
+    full_name = (message.text or "").strip()
     if len(full_name.split()) < 2:
-        bot.send_message(message.chat.id, get_text("name_error", lang))
-        bot.register_next_step_handler(message, get_name, lang)
+        dispatcher.send_message(message.chat.id, get_text("name_error", lang))
         return
-    user_data[message.chat.id]['full_name'] = full_name
-    bot.send_message(message.chat.id, get_text("get_phone_prompt", lang))
-    bot.register_next_step_handler(message, get_phone, lang)
+    data['full_name'] = full_name
+    conversations.set(message.chat.id, "phone", data)
+    dispatcher.send_message(message.chat.id, get_text("get_phone_prompt", lang))
 
 
-def get_phone(message, lang):
-    phone = message.text.strip()
+def get_phone(message, lang, data):
+    phone = (message.text or "").strip()
     if not phone.startswith("+"):
-        bot.send_message(message.chat.id, get_text("phone_error", lang))
-        bot.register_next_step_handler(message, get_phone, lang)
+        dispatcher.send_message(message.chat.id, get_text("phone_error", lang))
         return
-    user_data[message.chat.id]['phone'] = phone
-    user_data[message.chat.id]['tg_id'] = message.from_user.id
+    data['phone'] = phone
+    data['tg_id'] = message.from_user.id
+    conversations.set(message.chat.id, "confirm", data)
 
-    text = (f"{get_text('confirm_data_prompt', lang)}\n\n"
-            f"👤 {get_text('full_name_label', lang)}: {user_data[message.chat.id]['full_name']}\n"
-            f"📞 {get_text('phone_label', lang)}: {user_data[message.chat.id]['phone']}")
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton(get_text("confirm_yes_btn", lang), callback_data="confirm_yes"))
-    markup.add(types.InlineKeyboardButton(get_text("confirm_no_btn", lang), callback_data="confirm_no"))
-    bot.send_message(message.chat.id, text, reply_markup=markup)
+    text = catalog.render("confirm_data", lang, full_name=data['full_name'], phone=data['phone'])
+    dispatcher.send_message(message.chat.id, text, reply_markup=yes_no_keyboard(lang, "confirm_yes_btn", "confirm_no_btn", "confirm"))
 
 
 @bot.callback_query_handler(func=lambda call: call.data in ["confirm_yes", "confirm_no"])
@@ -379,59 +694,77 @@ def confirm_data(call):
     _, _, lang = get_or_create_user(call.from_user.id)
     bot.answer_callback_query(call.id)
     if call.data == "confirm_no":
-        bot.edit_message_text(get_text("restart_prompt", lang),
-                              chat_id=call.message.chat.id, message_id=call.message.message_id)
-        user_data[call.message.chat.id] = {}
-        bot.register_next_step_handler(call.message, get_name, lang)
+        dispatcher.edit_message_text(get_text("restart_prompt", lang),
+                                     chat_id=call.message.chat.id, message_id=call.message.message_id)
+        conversations.set(call.message.chat.id, "name", {})
     else:
         user_id, _, _ = get_or_create_user(call.from_user.id)
-        address_text = (
-            f"📍 Филиал в Китае: \n\n"
-            f"Warehouse 55055, No. B7, No. 101 Zhanqian Road, Liwan District, Guangzhou, Niuyun Hengtong Logistics 13178855505\n\n"
-            f"广州市荔湾区站前路101号B7号5505库房牛运亨通物流13178855505\n\n"
-            f"{get_text('address_prompt', lang).format(user_id=user_id)}"
-        )
-        bot.edit_message_text(address_text, chat_id=call.message.chat.id, message_id=call.message.message_id)
-        bot.register_next_step_handler(call.message, get_order_number, lang)
+        step, data = conversations.get(call.message.chat.id)
+        if step != "confirm":
+            dispatcher.edit_message_text(get_text("order_info_error", lang), chat_id=call.message.chat.id,
+                                         message_id=call.message.message_id)
+            return
+        conversations.set(call.message.chat.id, "order_number", data)
+        dispatcher.edit_message_text(address_text(lang, user_id), chat_id=call.message.chat.id, message_id=call.message.message_id)
 
 
-def get_order_number(message, lang):
+def get_order_number(message, lang, data):
     if message.text is None:
-        bot.send_message(message.chat.id, get_text("get_order_number_error", lang))
-        bot.register_next_step_handler(message, get_order_number, lang)
+        dispatcher.send_message(message.chat.id, get_text("get_order_number_error", lang))
         return
-    user_data[message.chat.id]['order_number'] = message.text.strip()
-    user_data[message.chat.id]['order_date'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    data['order_number'] = message.text.strip()
+    data['order_date'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conversations.set(message.chat.id, "location", data)
 
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    markup.add(types.KeyboardButton(get_text("location_share_btn", lang), request_location=True))
-    bot.send_message(message.chat.id, get_text("get_location_prompt", lang), reply_markup=markup)
+    dispatcher.send_message(message.chat.id, get_text("get_location_prompt", lang), reply_markup=location_keyboard(lang))
 
 
 @bot.message_handler(content_types=['location'])
 def get_location(message):
-    _, _, lang = get_or_create_user(message.from_user.id)
+    user_id, _, lang = get_or_create_user(message.from_user.id)
     chat_id = message.chat.id
-    bot.send_message(chat_id, get_text("location_received", lang), reply_markup=ReplyKeyboardRemove())
+    step, data = conversations.get(chat_id)
+    if step not in ("location", "save"):
+        return
+    dispatcher.send_message(chat_id, get_text("location_received", lang), reply_markup=ReplyKeyboardRemove())
 
-    user_data[chat_id]['latitude'] = message.location.latitude
-    user_data[chat_id]['longitude'] = message.location.longitude
+    data['latitude'] = message.location.latitude
+    data['longitude'] = message.location.longitude
+    conversations.set(chat_id, "save", data)
 
-    user_id, _, _ = get_or_create_user(message.from_user.id)
-    location_links = get_location_link(message.location.latitude, message.location.longitude, lang)
-    summary = (
-        f"{get_text('final_check_prompt', lang)}\n\n"
-        f"👤 {get_text('full_name_label', lang)}: {user_data[chat_id]['full_name']}\n"
-        f"📞 {get_text('phone_label', lang)}: {user_data[chat_id]['phone']}\n"
-        f"♾️ {get_text('taobao_id_label', lang)}: <code>Gv{user_id}</code>\n"
-        f"📦 {get_text('taobao_order_num_label', lang)}: {user_data[chat_id]['order_number']}\n"
-        f"📅 {get_text('date_label', lang)}: {user_data[chat_id]['order_date']}\n"
-        f"📍 {get_text('location_label', lang)}: {location_links}"
+    summary = catalog.render(
+        "final_check", lang, full_name=data['full_name'], phone=data['phone'], user_id=user_id,
+        order_number=data['order_number'], order_date=data['order_date'],
+        location=get_location_link(message.location.latitude, message.location.longitude, lang)
     )
-    kb = types.InlineKeyboardMarkup()
-    kb.add(types.InlineKeyboardButton(get_text("final_confirm_btn", lang), callback_data="save_yes"))
-    kb.add(types.InlineKeyboardButton(get_text("final_reject_btn", lang), callback_data="save_no"))
-    bot.send_message(chat_id, summary, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
+    kb = yes_no_keyboard(lang, "final_confirm_btn", "final_reject_btn", "save")
+    dispatcher.send_message(chat_id, summary, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
+
+
+def store_order(data, lang):
+    """Сохраняет заказ из данных сценария и возвращает тексты для группы и для пользователя."""
+    user_id, _, _ = get_or_create_user(data['tg_id'])
+
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+
+    location_link_sheets = f"https://maps.google.com/?q={latitude},{longitude}" if latitude else ""
+    location_link_html = get_location_link(latitude, longitude, lang)
+
+    applicant_value = applicant_allocator.next() if applicant_allocator else None
+    applicant_code = db.insert_order(user_id, data['tg_id'], data, location_link_sheets, applicant_value)
+    sheet_writer.notify()
+
+    order_text_for_group = GROUP_ORDER_TEMPLATE.format(
+        code=applicant_code, user_id=user_id, full_name=data['full_name'], phone=data['phone'],
+        tg_id=data['tg_id'], order_number=data['order_number'], order_date=data['order_date'],
+        location=location_link_html
+    )
+    order_text_for_user = catalog.render(
+        "order_success", lang, code=applicant_code, full_name=data['full_name'], phone=data['phone'],
+        order_number=data['order_number'], order_date=data['order_date'], location=location_link_html
+    )
+    return order_text_for_group, order_text_for_user
 
 
 @bot.callback_query_handler(func=lambda call: call.data in ["save_yes", "save_no"])
@@ -441,68 +774,95 @@ def final_save(call):
     bot.answer_callback_query(call.id)
 
     if call.data == "save_no":
-        bot.edit_message_text(get_text("final_restart_prompt", lang),
-                              chat_id=chat_id, message_id=call.message.message_id)
-        user_data[chat_id] = {}
-        bot.register_next_step_handler(call.message, get_name, lang)
+        dispatcher.edit_message_text(get_text("final_restart_prompt", lang),
+                                     chat_id=chat_id, message_id=call.message.message_id)
+        conversations.set(chat_id, "name", {})
         return
 
-    data = user_data[chat_id]
-    user_id, _, _ = get_or_create_user(data['tg_id'])
-
-    cursor.execute("SELECT COUNT(id) FROM orders")
-    count = cursor.fetchone()[0]
-    applicant_code = f"Gv{1000 + count + 1}"
+    step, data = conversations.get(chat_id)
+    if step != "save":
+        dispatcher.edit_message_text(get_text("order_info_error", lang), chat_id=chat_id,
+                                     message_id=call.message.message_id)
+        return
+    order_text_for_group, order_text_for_user = store_order(data, lang)
+    dispatcher.send_message(GROUP_ID, order_text_for_group, parse_mode="HTML", disable_web_page_preview=True)
 
-    latitude = data.get('latitude')
-    longitude = data.get('longitude')
+    dispatcher.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                 text=order_text_for_user, parse_mode="HTML", disable_web_page_preview=True)
+    conversations.clear(chat_id)
+    main_menu(chat_id, lang)
 
-    location_link_sheets = f"https://maps.google.com/?q={latitude},{longitude}" if latitude else ""
-    location_link_html = get_location_link(latitude, longitude, lang)
 
-    cursor.execute("""
-        INSERT INTO orders (user_id, full_name, phone, order_number, order_date, latitude, longitude, location, applicant_order_number)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        user_id, data['full_name'], data['phone'], data['order_number'], data['order_date'],
-        latitude, longitude, location_link_sheets, applicant_code
-    ))
-    conn.commit()
-    sheet.append_row([
-        data['tg_id'], data['full_name'], data['phone'], data['order_number'],
-        data['order_date'], location_link_sheets, applicant_code
-    ])
-
-    order_text_for_group = (
-        f"🆕 <b>Новый заказ!</b>\n\n"
-        f"Номер заказа заявителя: <code>{applicant_code}</code>\n"
-        f"Уникальный ID: <code>{user_id}</code>\n\n"
-        f"<b>Клиент:</b>\n"
-        f"👤 {data['full_name']}\n"
-        f"📞 {data['phone']}\n"
-        f"🆔 <a href='tg://user?id={data['tg_id']}'>{data['tg_id']}</a>\n\n"
-        f"<b>Заказ:</b>\n"
-        f"📦 Taobao №: {data['order_number']}\n"
-        f"📅 Дата: {data['order_date']}\n"
-        f"📍 Локация: {location_link_html}"
-    )
-    bot.send_message(GROUP_ID, order_text_for_group, parse_mode="HTML", disable_web_page_preview=True)
-
-    order_text_for_user = (
-        f"{get_text('order_success_title', lang)}\n\n"
-        f"{get_text('your_order_number', lang)}: <code>{applicant_code}</code>\n\n"
-        f"<b>{get_text('details', lang)}:</b>\n"
-        f"👤 {data['full_name']}\n"
-        f"📞 {data['phone']}\n"
-        f"📦 Taobao №: {data['order_number']}\n"
-        f"📅 {data['order_date']}\n"
-        f"📍 {get_text('location_label', lang)}: {location_link_html}"
-    )
-    bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
-                          text=order_text_for_user, parse_mode="HTML", disable_web_page_preview=True)
-    main_menu(chat_id, lang)
-    user_data[chat_id] = {}
+def print_startup_report():
+    prev = _startup_t0
+    for phase, ts in startup_timings:
+        print(f"startup {phase}: {(ts - prev) * 1000:.1f} ms")
+        prev = ts
+    print(f"startup total: {(prev - _startup_t0) * 1000:.1f} ms")
+
+
+# Действия кнопок главного меню (см. i18n.MENU_ACTIONS)
+MENU_HANDLERS = {
+    "order": order_start,
+    "my_orders": my_orders,
+    "stats": get_stats,
+    "order_info": get_order_info_start,
+    "help": help_message,
+    "settings": show_settings,
+}
+ADMIN_ACTIONS = {"stats", "order_info"}
+
+# Шаги сценариев, ожидающие следующее сообщение пользователя
+STEP_HANDLERS = {
+    "name": get_name,
+    "phone": get_phone,
+    "order_number": get_order_number,
+    "admin_find": find_order_by_applicant_number,
+    "broadcast_text": broadcast_text,
+    "near_point": near_point,
+}
+
+# Рассылки: идут через тот же dispatcher, но со своим, более низким темпом
+broadcaster = broadcast.Broadcaster(dispatcher, BROADCAST_RATE, on_done=broadcast_done)
+
+if METRICS_PORT:
+    metrics.instrument_handlers(bot)
+    metrics.instrument_table(MENU_HANDLERS)
+    metrics.instrument_table(STEP_HANDLERS)
+    metrics.registry.add_gauges("dispatcher", dispatcher.metrics)
+    metrics.registry.add_gauges("user_cache", user_cache.stats)
+
+
+def start_background(send=True, primary=True):
+    """Запускает фоновые потоки: Google Sheets, исходящую очередь, прерванные рассылки и /metrics.
+    send=False — процесс сам ничего не отправляет в Telegram (супервизор, см. supervisor.py).
+    primary=False — выгрузку в таблицу и прерванные рассылки ведет другой процесс
+    с той же базой (остальные экземпляры webhook), здесь только отправка."""
+    if primary:
+        sheet_writer.start()
+    if send:
+        dispatcher.start()
+        if primary:
+            broadcaster.resume()
+    if METRICS_PORT:
+        metrics.serve(METRICS_HOST, METRICS_PORT)
+    mark_startup("background")
 
 
 if __name__ == '__main__':
-    bot.infinity_polling()
+    if BOT_MODE == "async":
+        # async_bot импортирует этот модуль как bot — отдаем ему уже загруженный __main__
+        sys.modules['bot'] = sys.modules['__main__']
+        import async_bot
+        async_bot.main()
+    elif BOT_MODE == "webhook":
+        import webhook
+        # Из нескольких экземпляров таблицу и прерванные рассылки ведет только WEBHOOK_INSTANCE=0
+        start_background(primary=WEBHOOK_INSTANCE == 0)
+        print_startup_report()
+        webhook.serve(bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL, WEBHOOK_SECRET,
+                      workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+    else:
+        start_background()
+        print_startup_report()
+        bot.infinity_polling()
@@ -0,0 +1,105 @@
+import json
+import re
+import threading
+import time
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+import db
+from i18n import DEFAULT_LANGUAGE, LANGUAGES
+from sender import TokenBucket
+
+_SECTION = re.compile(r"^\[(%s)\]\s*$" % "|".join(LANGUAGES), re.MULTILINE)
+
+
+def parse_texts(text):
+    """Разбирает текст рассылки на варианты по языкам ([ru], [en], [uz] на отдельных строках).
+    Языки без своего варианта получают первый указанный."""
+    parts = _SECTION.split(text)
+    if len(parts) == 1:
+        return {lang: text.strip() for lang in LANGUAGES}
+    texts = {parts[i]: parts[i + 1].strip() for i in range(1, len(parts) - 1, 2) if parts[i + 1].strip()}
+    fallback = texts.get(DEFAULT_LANGUAGE) or next(iter(texts.values()), text.strip())
+    return {lang: texts.get(lang, fallback) for lang in LANGUAGES}
+
+
+class Broadcaster:
+    """Рассылка всем пользователям порциями по chunk_size.
+
+    Получатели читаются из users по возрастанию id, в памяти только текущая порция.
+    Сообщения уходят параллельно через Dispatcher, общий темп ограничен rate в секунду,
+    чтобы рассылка не забирала весь лимит у обычных ответов. Результат по каждому
+    получателю пишется в broadcast_deliveries по мере отправки, группами по record_every:
+    после падения повторно уходят только сообщения последней незаписанной группы
+    и те, что были в очереди отправки. Заблокировавшие бота помечаются в users.blocked
+    и дальше пропускаются.
+    """
+
+    def __init__(self, dispatcher, rate=25.0, chunk_size=500, on_done=None, record_every=20):
+        self.dispatcher = dispatcher
+        self.bucket = TokenBucket(rate, rate)
+        self.chunk_size = chunk_size
+        self.on_done = on_done
+        self.record_every = record_every
+
+    def start(self, text, admin_chat_id, admin_lang):
+        broadcast_id = db.create_broadcast(json.dumps(parse_texts(text), ensure_ascii=False), admin_chat_id, admin_lang)
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    def resume(self):
+        """Продолжает рассылки, прерванные перезапуском."""
+        for broadcast_id in db.running_broadcasts():
+            self._spawn(broadcast_id)
+
+    def _spawn(self, broadcast_id):
+        threading.Thread(target=self._run, args=(broadcast_id,), name=f"broadcast-{broadcast_id}", daemon=True).start()
+
+    def _run(self, broadcast_id):
+        texts_json, last_user_id, admin_chat_id, admin_lang = db.get_broadcast(broadcast_id)
+        texts = json.loads(texts_json)
+        while True:
+            recipients = db.broadcast_recipients(broadcast_id, last_user_id, self.chunk_size)
+            if not recipients:
+                break
+            pending = deque()
+            results = []
+            for user_id, tg_id, lang in recipients:
+                delay = self.bucket.reserve()
+                if delay:
+                    time.sleep(delay)
+                pending.append((user_id, self.dispatcher.send_message(tg_id, texts.get(lang) or texts[DEFAULT_LANGUAGE])))
+                # Завершенные с начала очереди пишутся сразу, пока остальные еще отправляются
+                while pending and pending[0][1].done():
+                    results.append(_result(*pending.popleft()))
+                if len(results) >= self.record_every:
+                    last_user_id = self._record(broadcast_id, results)
+                    results = []
+            while pending:
+                results.append(_result(*pending.popleft()))
+                if len(results) >= self.record_every:
+                    last_user_id = self._record(broadcast_id, results)
+                    results = []
+            if results:
+                last_user_id = self._record(broadcast_id, results)
+        db.finish_broadcast(broadcast_id)
+        if self.on_done:
+            self.on_done(broadcast_id, admin_chat_id, admin_lang, db.broadcast_totals(broadcast_id))
+
+    @staticmethod
+    def _record(broadcast_id, results):
+        """Пишет результаты и сдвигает курсор; результаты идут подряд по id, курсор — последний из них."""
+        last_user_id = results[-1][0]
+        db.record_deliveries(broadcast_id, results, last_user_id)
+        return last_user_id
+
+
+def _result(user_id, future):
+    """(user_id, статус доставки); ждет завершения отправки."""
+    error = future.exception()
+    if error is None:
+        return user_id, "sent"
+    if isinstance(error, ApiTelegramException) and error.error_code == 403:
+        return user_id, "blocked"
+    return user_id, "failed"
@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CachedUser = namedtuple("CachedUser", "user_id agreed language_code")
+
+
+class UserCache:
+    """Ограниченный LRU-кеш профилей пользователей по tg_id с временем жизни записи.
+    При maxsize=0 ничего не хранит: каждый get — промах."""
+
+    def __init__(self, maxsize=10000, ttl=600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tg_id):
+        with self._lock:
+            item = self._items.get(tg_id)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._items[tg_id]
+                self.misses += 1
+                return None
+            self._items.move_to_end(tg_id)
+            self.hits += 1
+            return item[0]
+
+    def put(self, tg_id, user):
+        with self._lock:
+            self._items[tg_id] = (CachedUser(*user), time.monotonic() + self.ttl)
+            self._items.move_to_end(tg_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def update(self, tg_id, **fields):
+        """Обновляет поля закешированной записи после записи в БД. Отсутствующая запись не создается."""
+        with self._lock:
+            item = self._items.get(tg_id)
+            if item is not None:
+                self._items[tg_id] = (item[0]._replace(**fields), item[1])
+
+    def invalidate(self, tg_id):
+        with self._lock:
+            self._items.pop(tg_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
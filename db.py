@@ -0,0 +1,455 @@
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+import geo
+import search
+import sequences
+import sheets
+import stats
+
+_path = None
+_local = threading.local()
+_writer = None
+# Класс соединения; metrics.TimedConnection добавляет замер каждого запроса
+connection_factory = sqlite3.Connection
+
+
+def connect(path):
+    """Открывает соединение в режиме WAL: чтения не блокируются записью."""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False,
+                           factory=connection_factory)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def init(path):
+    """Создает схему и запускает поток записи. Вызывается один раз при старте."""
+    global _path, _writer
+    _path = path
+    conn = connect(path)
+    with conn:
+        # IMMEDIATE: процессы-воркеры (supervisor.py) стартуют одновременно и ждут друг друга, а не падают с "locked"
+        conn.execute("BEGIN IMMEDIATE")
+        init_schema(conn)
+    conn.close()
+    _writer = Writer(path)
+    _writer.start()
+
+
+def init_schema(conn):
+    # Таблица пользователей: добавлено поле языка
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tg_id INTEGER UNIQUE,
+        agreed INTEGER DEFAULT 0,
+        language_code TEXT DEFAULT 'ru'
+    )
+    """)
+
+    # Таблица заказов: без изменений
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        full_name TEXT,
+        phone TEXT,
+        order_number TEXT,
+        order_date TEXT,
+        latitude REAL,
+        longitude REAL,
+        applicant_order_number TEXT UNIQUE,
+        location TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    migrate(conn)
+    search.init_search(conn)
+
+    # Незавершенные сценарии (оформление заказа, просмотр заказов) по чатам
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS conversations (
+        chat_id INTEGER,
+        flow TEXT,
+        step TEXT,
+        data TEXT,
+        updated_at REAL,
+        PRIMARY KEY (chat_id, flow)
+    )
+    """)
+    # Рассылки и результат доставки по каждому получателю
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        texts TEXT NOT NULL,
+        admin_chat_id INTEGER,
+        admin_lang TEXT,
+        status TEXT DEFAULT 'running',
+        last_user_id INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        broadcast_id INTEGER,
+        user_id INTEGER,
+        status TEXT,
+        PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID
+    """)
+    sheets.init_outbox(conn)
+    sequences.init_sequences(conn)
+    sequences.seed_applicant_sequence(conn)
+    stats.init_stats(conn)
+
+
+def migrate(conn):
+    """Добавляет колонки и индексы, которых не было в исходной схеме."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if "orders_count" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN orders_count INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE users SET orders_count = (SELECT COUNT(id) FROM orders WHERE orders.user_id = users.id)")
+    if "blocked" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN blocked INTEGER NOT NULL DEFAULT 0")
+    if "status" not in {row[1] for row in conn.execute("PRAGMA table_info(orders)")}:
+        conn.execute("ALTER TABLE orders ADD COLUMN status TEXT NOT NULL DEFAULT 'new'")
+    # users(tg_id) уже проиндексирован ограничением UNIQUE
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_order_date ON orders (order_date)")
+    # Поиск рядом с точкой (geo.near_orders): статус, затем диапазон широт, долгота — из того же индекса
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_location ON orders (status, latitude, longitude)")
+
+
+def reader():
+    """Соединение для чтения, свое у каждого потока."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect(_path)
+    return conn
+
+
+# ---------------- Запись ----------------
+class Writer(threading.Thread):
+    """Единственный поток записи. Накопившиеся задания выполняются в одной транзакции
+    (group commit), каждое под своим SAVEPOINT, чтобы ошибка одного не откатывала остальные."""
+
+    def __init__(self, path, max_batch=100):
+        super().__init__(name="db-writer", daemon=True)
+        self.path = path
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.jobs.put((fn, args, future))
+        return future
+
+    def run(self):
+        conn = connect(self.path)
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(conn, batch)
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, _ in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((fn(conn, *args), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(None, e)] * len(batch)
+        for (_, _, future), (result, error) in zip(batch, results):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def write(fn, *args):
+    """Выполняет fn(conn, *args) в потоке записи и ждет результат после коммита."""
+    return _writer.submit(fn, *args).result()
+
+
+def write_async(fn, *args):
+    return _writer.submit(fn, *args)
+
+
+# ---------------- Пользователи ----------------
+def get_user(tg_id):
+    return reader().execute(
+        "SELECT id, agreed, language_code FROM users WHERE tg_id = ?", (tg_id,)
+    ).fetchone()
+
+
+def _create_user(conn, tg_id):
+    if conn.execute("INSERT OR IGNORE INTO users (tg_id, agreed) VALUES (?, ?)", (tg_id, 0)).rowcount:
+        stats.bump(conn, "users")
+    return conn.execute("SELECT id FROM users WHERE tg_id = ?", (tg_id,)).fetchone()[0]
+
+
+def create_user(tg_id):
+    return write(_create_user, tg_id)
+
+
+def _set_language(conn, tg_id, lang_code):
+    conn.execute("UPDATE users SET language_code = ? WHERE tg_id = ?", (lang_code, tg_id))
+
+
+def set_language(tg_id, lang_code):
+    write(_set_language, tg_id, lang_code)
+
+
+def _set_agreed(conn, tg_id):
+    if conn.execute("UPDATE users SET agreed = 1 WHERE tg_id = ? AND agreed = 0", (tg_id,)).rowcount:
+        stats.bump(conn, "agreed")
+
+
+def set_agreed(tg_id):
+    write(_set_agreed, tg_id)
+
+
+def _set_unblocked(conn, tg_id):
+    conn.execute("UPDATE users SET blocked = 0 WHERE tg_id = ? AND blocked = 1", (tg_id,))
+
+
+def set_unblocked(tg_id):
+    """Снимает отметку блокировки, когда пользователь снова пишет боту."""
+    write_async(_set_unblocked, tg_id)
+
+
+def get_dashboard():
+    return stats.dashboard(reader())
+
+
+# ---------------- Состояния диалогов ----------------
+def get_conversation(chat_id, flow):
+    return reader().execute(
+        "SELECT step, data, updated_at FROM conversations WHERE chat_id = ? AND flow = ?", (chat_id, flow)
+    ).fetchone()
+
+
+def _save_conversation(conn, chat_id, flow, step, data, updated_at):
+    old = conn.execute("SELECT step FROM conversations WHERE chat_id = ? AND flow = ?", (chat_id, flow)).fetchone()
+    stats.record_step(conn, old and old[0], step)
+    conn.execute(
+        "INSERT OR REPLACE INTO conversations (chat_id, flow, step, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (chat_id, flow, step, data, updated_at)
+    )
+
+
+def save_conversation(chat_id, flow, step, data, updated_at):
+    return write_async(_save_conversation, chat_id, flow, step, data, updated_at)
+
+
+def _delete_conversation(conn, chat_id, flow):
+    conn.execute("DELETE FROM conversations WHERE chat_id = ? AND flow = ?", (chat_id, flow))
+
+
+def delete_conversation(chat_id, flow):
+    return write_async(_delete_conversation, chat_id, flow)
+
+
+def _purge_conversations(conn, before):
+    conn.execute("DELETE FROM conversations WHERE updated_at < ?", (before,))
+
+
+def purge_conversations(before):
+    write_async(_purge_conversations, before)
+
+
+# ---------------- Рассылки ----------------
+def _create_broadcast(conn, texts, admin_chat_id, admin_lang):
+    return conn.execute(
+        "INSERT INTO broadcasts (texts, admin_chat_id, admin_lang) VALUES (?, ?, ?)", (texts, admin_chat_id, admin_lang)
+    ).lastrowid
+
+
+def create_broadcast(texts, admin_chat_id, admin_lang):
+    return write(_create_broadcast, texts, admin_chat_id, admin_lang)
+
+
+def running_broadcasts():
+    return [row[0] for row in reader().execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")]
+
+
+def get_broadcast(broadcast_id):
+    return reader().execute(
+        "SELECT texts, last_user_id, admin_chat_id, admin_lang FROM broadcasts WHERE id = ?", (broadcast_id,)
+    ).fetchone()
+
+
+def broadcast_recipients(broadcast_id, after_user_id, limit):
+    """Следующая порция получателей после after_user_id, без заблокировавших бота и уже обработанных."""
+    return reader().execute("""
+        SELECT u.id, u.tg_id, u.language_code FROM users u
+        WHERE u.id > ? AND u.blocked = 0
+          AND NOT EXISTS (SELECT 1 FROM broadcast_deliveries d WHERE d.broadcast_id = ? AND d.user_id = u.id)
+        ORDER BY u.id LIMIT ?
+    """, (after_user_id, broadcast_id, limit)).fetchall()
+
+
+def _record_deliveries(conn, broadcast_id, results, last_user_id):
+    conn.executemany(
+        "INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, user_id, status) VALUES (?, ?, ?)",
+        [(broadcast_id, user_id, status) for user_id, status in results]
+    )
+    conn.executemany("UPDATE users SET blocked = 1 WHERE id = ?",
+                     [(user_id,) for user_id, status in results if status == "blocked"])
+    conn.execute("UPDATE broadcasts SET last_user_id = ? WHERE id = ?", (last_user_id, broadcast_id))
+
+
+def record_deliveries(broadcast_id, results, last_user_id):
+    write(_record_deliveries, broadcast_id, results, last_user_id)
+
+
+def _finish_broadcast(conn, broadcast_id):
+    conn.execute("UPDATE broadcasts SET status = 'done' WHERE id = ?", (broadcast_id,))
+
+
+def finish_broadcast(broadcast_id):
+    write(_finish_broadcast, broadcast_id)
+
+
+def broadcast_totals(broadcast_id):
+    totals = {"sent": 0, "blocked": 0, "failed": 0}
+    totals.update(reader().execute(
+        "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status", (broadcast_id,)
+    ).fetchall())
+    return totals
+
+
+# ---------------- Заказы ----------------
+def _insert_order(conn, user_id, tg_id, data, location, applicant_value):
+    if applicant_value is None:
+        applicant_value = sequences.next_value(conn, "applicant")
+    applicant_code = sequences.applicant_code(applicant_value)
+    conn.execute("""
+        INSERT INTO orders (user_id, full_name, phone, order_number, order_date, latitude, longitude, location, applicant_order_number)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        user_id, data['full_name'], data['phone'], data['order_number'], data['order_date'],
+        data.get('latitude'), data.get('longitude'), location, applicant_code
+    ))
+    conn.execute("UPDATE users SET orders_count = orders_count + 1 WHERE id = ?", (user_id,))
+    stats.record_order(conn, user_id, data['order_date'])
+    sheets.enqueue_row(conn, [
+        tg_id, data['full_name'], data['phone'], data['order_number'],
+        data['order_date'], location, applicant_code
+    ])
+    return applicant_code
+
+
+def insert_order(user_id, tg_id, data, location, applicant_value=None):
+    """Сохраняет заказ и строку для Google Sheets одной транзакцией, возвращает номер заявителя."""
+    return write(_insert_order, user_id, tg_id, data, location, applicant_value)
+
+
+def count_user_orders(user_id):
+    """Число заказов пользователя из счетчика users.orders_count, без подсчета по orders."""
+    row = reader().execute("SELECT orders_count FROM users WHERE id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+_ORDER_CARD = "SELECT id, applicant_order_number, full_name, phone, order_number, order_date, latitude, longitude FROM orders"
+
+
+def first_user_order(user_id):
+    return reader().execute(f"{_ORDER_CARD} WHERE user_id = ? ORDER BY id LIMIT 1", (user_id,)).fetchone()
+
+
+def last_user_order(user_id):
+    return reader().execute(f"{_ORDER_CARD} WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)).fetchone()
+
+
+def user_order_after(user_id, order_id):
+    return reader().execute(
+        f"{_ORDER_CARD} WHERE user_id = ? AND id > ? ORDER BY id LIMIT 1", (user_id, order_id)
+    ).fetchone()
+
+
+def user_order_before(user_id, order_id):
+    return reader().execute(
+        f"{_ORDER_CARD} WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT 1", (user_id, order_id)
+    ).fetchone()
+
+
+def find_order(applicant_order_number):
+    return reader().execute("""
+        SELECT o.applicant_order_number, o.full_name, o.phone, o.order_number, o.order_date, o.location, u.tg_id
+        FROM orders o JOIN users u ON o.user_id = u.id
+        WHERE o.applicant_order_number = ?
+    """, (applicant_order_number,)).fetchone()
+
+
+def _set_order_status(conn, applicant_order_number, status):
+    return conn.execute(
+        "UPDATE orders SET status = ? WHERE applicant_order_number = ?", (status, applicant_order_number)
+    ).rowcount
+
+
+def set_order_status(applicant_order_number, status):
+    """Меняет статус заказа; False, если заказа с таким номером нет."""
+    return bool(write(_set_order_status, applicant_order_number, status))
+
+
+def iter_orders(date_from=None, date_before=None, status=None, chunk=1000):
+    """Заказы с Telegram ID для выгрузки, порциями по chunk строк.
+    Отдельное соединение держит один снимок БД до конца выгрузки и закрывается после нее."""
+    where, params = [], []
+    if date_from:
+        where.append("o.order_date >= ?")
+        params.append(date_from)
+    if date_before:
+        where.append("o.order_date < ?")
+        params.append(date_before)
+    if status:
+        where.append("o.status = ?")
+        params.append(status)
+    # С фильтром по дате порядок совпадает с индексом idx_orders_order_date, без сортировки
+    conn = connect(_path)
+    try:
+        cursor = conn.execute(f"""
+            SELECT u.tg_id, o.full_name, o.phone, o.order_number, o.order_date, o.location,
+                   o.applicant_order_number, o.status
+            FROM orders o JOIN users u ON o.user_id = u.id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {"o.order_date, o.id" if date_from or date_before else "o.id"}
+        """, params)
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def search_orders(text, page=0):
+    return search.search_orders(reader(), text, page)
+
+
+def near_orders(latitude, longitude, radius_km, status):
+    return geo.near_orders(reader(), latitude, longitude, radius_km, status)
+
+
+def order_zones(day, radius_km, status=None):
+    return geo.zones(reader(), day, radius_km, status)
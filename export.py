@@ -0,0 +1,102 @@
+"""Выгрузка заказов в CSV или XLSX.
+
+Строки читаются курсором SQLite порциями и сразу пишутся во временный файл,
+поэтому память не растет с числом заказов. XLSX доступен, если установлен openpyxl
+(режим write_only тоже пишет лист потоково).
+"""
+import csv
+import os
+import re
+import tempfile
+from datetime import date, timedelta
+
+import db
+from sheets import SHEET_HEADER
+
+HEADER = SHEET_HEADER + ["Статус"]
+FORMATS = ("csv", "xlsx")
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def xlsx_available():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parse_filters(args):
+    """Разбирает аргументы команды: до двух дат ГГГГ-ММ-ДД (с, по), формат csv/xlsx и статус.
+    Возвращает словарь или None, если дата записана неверно."""
+    filters = {"date_from": None, "date_to": None, "status": None, "fmt": "csv"}
+    dates = []
+    for arg in args:
+        if _DATE.match(arg):
+            try:
+                dates.append(date.fromisoformat(arg))
+            except ValueError:
+                return None
+        elif arg.lower() in FORMATS:
+            filters["fmt"] = arg.lower()
+        else:
+            filters["status"] = arg
+    if len(dates) > 2:
+        return None
+    if dates:
+        filters["date_from"] = min(dates)
+        filters["date_to"] = max(dates)
+    return filters
+
+
+def write_export(fmt, date_from=None, date_to=None, status=None):
+    """Пишет заказы во временный файл и возвращает (путь, число строк). Файл удаляет вызывающий."""
+    fd, path = tempfile.mkstemp(prefix="orders_", suffix=f".{fmt}")
+    os.close(fd)
+    chunks = db.iter_orders(
+        date_from and date_from.isoformat(),
+        date_to and (date_to + timedelta(days=1)).isoformat(),
+        status
+    )
+    try:
+        count = _write_xlsx(path, chunks) if fmt == "xlsx" else _write_csv(path, chunks)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
+
+
+def file_name(fmt, date_from=None, date_to=None, status=None):
+    parts = ["orders"]
+    if date_from:
+        parts.append(date_from.isoformat() if date_from == date_to else f"{date_from}_{date_to}")
+    if status:
+        parts.append(re.sub(r"\W", "", status))
+    return "_".join(parts) + f".{fmt}"
+
+
+def _write_csv(path, chunks):
+    count = 0
+    # utf-8-sig: Excel открывает кириллицу без ручного выбора кодировки
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _write_xlsx(path, chunks):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("orders")
+    sheet.append(HEADER)
+    count = 0
+    for rows in chunks:
+        for row in rows:
+            sheet.append(row)
+        count += len(rows)
+    workbook.save(path)
+    return count
@@ -0,0 +1,157 @@
+"""Заказы по координатам: «рядом с точкой» и зоны доставки на день.
+
+Поиск в радиусе идет по индексу idx_orders_status_location (status, latitude, longitude):
+из него берутся заказы нужного статуса внутри ограничивающего прямоугольника, точное
+расстояние (haversine) считается только для них, а не для каждой строки orders.
+Статус стоит в индексе первым, поэтому время запроса не растет с историей доставленных заказов.
+Зоны доставки на день строятся по сетке из ячеек размером с радиус зоны, без попарных
+расстояний между всеми заказами.
+"""
+import math
+import re
+from collections import defaultdict
+from datetime import date, timedelta
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+DEFAULT_RADIUS_KM = 3.0
+MAX_RADIUS_KM = 50.0
+DEFAULT_STATUS = "new"
+NEAR_LIMIT = 20
+DEFAULT_ZONE_KM = 2.0
+MAX_ZONE_KM = 50.0
+# Сколько зон и номеров в зоне помещается в одно сообщение
+ZONES_SHOWN = 15
+ZONE_CODES_SHOWN = 10
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_POINT = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*[,; ]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def map_url(latitude, longitude):
+    return f"https://www.google.com/maps/search/?api=1&query={latitude:.6f},{longitude:.6f}"
+
+
+# ---------------- Аргументы команд ----------------
+def parse_point(text):
+    """Координаты из текста вида «41.31, 69.28» или None."""
+    match = _POINT.match(text or "")
+    if not match:
+        return None
+    latitude, longitude = float(match.group(1)), float(match.group(2))
+    if abs(latitude) > 90 or abs(longitude) > 180:
+        return None
+    return latitude, longitude
+
+
+def parse_near_args(args):
+    """Аргументы /near: радиус в км и статус в любом порядке. None, если радиус вне (0, MAX_RADIUS_KM]."""
+    filters = {"radius_km": DEFAULT_RADIUS_KM, "status": DEFAULT_STATUS}
+    for arg in args:
+        try:
+            radius = float(arg.replace(",", "."))
+        except ValueError:
+            filters["status"] = arg
+            continue
+        if not 0 < radius <= MAX_RADIUS_KM:
+            return None
+        filters["radius_km"] = radius
+    return filters
+
+
+def parse_zone_args(args, today=None):
+    """Аргументы /zones: день ГГГГ-ММ-ДД (по умолчанию сегодня), радиус зоны в км и статус."""
+    filters = {"day": today or date.today(), "radius_km": DEFAULT_ZONE_KM, "status": None}
+    for arg in args:
+        if _DATE.match(arg):
+            try:
+                filters["day"] = date.fromisoformat(arg)
+            except ValueError:
+                return None
+            continue
+        try:
+            radius = float(arg.replace(",", "."))
+        except ValueError:
+            filters["status"] = arg
+            continue
+        if not 0 < radius <= MAX_ZONE_KM:
+            return None
+        filters["radius_km"] = radius
+    return filters
+
+
+# ---------------- Запросы ----------------
+def near_orders(cursor, latitude, longitude, radius_km=DEFAULT_RADIUS_KM, status=DEFAULT_STATUS, limit=NEAR_LIMIT):
+    """Ближайшие заказы в радиусе по возрастанию расстояния и их общее число.
+    Строка: (расстояние км, номер заявителя, ФИО, телефон, широта, долгота)."""
+    dlat = radius_km / KM_PER_DEGREE
+    # Градус долготы короче к полюсам; у самого полюса прямоугольник просто охватывает все долготы
+    dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+    rows = cursor.execute("""
+        SELECT applicant_order_number, full_name, phone, latitude, longitude FROM orders
+        WHERE status = ? AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+    """, (status, latitude - dlat, latitude + dlat, longitude - dlon, longitude + dlon)).fetchall()
+    found = []
+    for code, full_name, phone, lat, lon in rows:
+        distance = distance_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            found.append((distance, code, full_name, phone, lat, lon))
+    found.sort()
+    return found[:limit], len(found)
+
+
+def zones(cursor, day, radius_km=DEFAULT_ZONE_KM, status=None):
+    """Заказы дня с локацией, сгруппированные в зоны доставки радиусом около radius_km.
+    Зона: (число заказов, широта центра, долгота центра, [номера заявителей]); крупные первыми.
+
+    Точки раскладываются по сетке с шагом radius_km. Самая заполненная ячейка становится зоной
+    и забирает из соседних ячеек свободные заказы не дальше radius_km от своего центра — так
+    плотное скопление не режется границей сетки пополам. Дальше — следующая по заполненности ячейка.
+    """
+    where = ["order_date >= ?", "order_date < ?", "latitude IS NOT NULL", "longitude IS NOT NULL"]
+    params = [day.isoformat(), (day + timedelta(days=1)).isoformat()]
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    rows = cursor.execute(
+        f"SELECT applicant_order_number, latitude, longitude FROM orders WHERE {' AND '.join(where)} ORDER BY id",
+        params
+    ).fetchall()
+    if not rows:
+        return []
+    # Плоские координаты в км: долгота сжата по средней широте дня, для одного города этого достаточно
+    mean_lat = sum(lat for _, lat, _ in rows) / len(rows)
+    lon_km = KM_PER_DEGREE * math.cos(math.radians(mean_lat))
+    points = [(lon * lon_km, lat * KM_PER_DEGREE) for _, lat, lon in rows]
+    cells = defaultdict(list)
+    for i, (x, y) in enumerate(points):
+        cells[(math.floor(x / radius_km), math.floor(y / radius_km))].append(i)
+
+    taken = [False] * len(rows)
+    result = []
+    for cx, cy in sorted(cells, key=lambda cell: len(cells[cell]), reverse=True):
+        members = [i for i in cells[(cx, cy)] if not taken[i]]
+        if not members:
+            continue
+        x0 = sum(points[i][0] for i in members) / len(members)
+        y0 = sum(points[i][1] for i in members) / len(members)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                if dx or dy:
+                    members += [i for i in cells.get((cx + dx, cy + dy), ())
+                                if not taken[i] and (points[i][0] - x0) ** 2 + (points[i][1] - y0) ** 2 <= radius_km ** 2]
+        for i in members:
+            taken[i] = True
+        result.append((
+            len(members),
+            sum(rows[i][1] for i in members) / len(members),
+            sum(rows[i][2] for i in members) / len(members),
+            [rows[i][0] for i in members],
+        ))
+    result.sort(key=lambda zone: zone[0], reverse=True)
+    return result
@@ -0,0 +1,126 @@
+import json
+from string import Formatter
+
+LANGUAGES = ("ru", "en", "uz")
+DEFAULT_LANGUAGE = "ru"
+
+# Кнопки главного меню -> действие для handle_text
+MENU_ACTIONS = {
+    "main_menu_order_btn": "order",
+    "main_menu_my_orders_btn": "my_orders",
+    "admin_stats_btn": "stats",
+    "admin_order_info_btn": "order_info",
+    "main_menu_help_btn": "help",
+    "main_menu_settings_btn": "settings",
+}
+
+# Шаблоны карточек: (ключ перевода, как есть) или "{поле}" для данных заказа.
+# Ключи из FORMAT_KEYS сохраняют свои подстановки, у остальных фигурные скобки экранируются.
+TEMPLATES = {
+    "order_card": (
+        "📋 ", ("order_x_of_y",), "\n\n",
+        ("your_order_number",), ": {code}\n",
+        "👤 ", ("full_name_label",), ": {full_name}\n",
+        "📞 ", ("phone_label",), ": {phone}\n",
+        "📦 ", ("taobao_order_num_label",), ": {order_number}\n",
+        "📅 ", ("date_label",), ": {order_date}\n",
+        "📍 ", ("location_label",), ": {location}",
+    ),
+    "confirm_data": (
+        ("confirm_data_prompt",), "\n\n",
+        "👤 ", ("full_name_label",), ": {full_name}\n",
+        "📞 ", ("phone_label",), ": {phone}",
+    ),
+    "final_check": (
+        ("final_check_prompt",), "\n\n",
+        "👤 ", ("full_name_label",), ": {full_name}\n",
+        "📞 ", ("phone_label",), ": {phone}\n",
+        "♾️ ", ("taobao_id_label",), ": <code>Gv{user_id}</code>\n",
+        "📦 ", ("taobao_order_num_label",), ": {order_number}\n",
+        "📅 ", ("date_label",), ": {order_date}\n",
+        "📍 ", ("location_label",), ": {location}",
+    ),
+    "order_success": (
+        ("order_success_title",), "\n\n",
+        ("your_order_number",), ": <code>{code}</code>\n\n",
+        "<b>", ("details",), ":</b>\n",
+        "👤 {full_name}\n",
+        "📞 {phone}\n",
+        "📦 Taobao №: {order_number}\n",
+        "📅 {order_date}\n",
+        "📍 ", ("location_label",), ": {location}",
+    ),
+    "admin_order": (
+        ("admin_order_found_title",), "\n\n",
+        ("admin_user_data_label",), "\n",
+        "👤 ", ("full_name_label",), ": {full_name}\n",
+        "📞 ", ("phone_label",), ": {phone}\n",
+        "💬 Telegram ID: <code>{tg_id}</code> (<a href='tg://user?id={tg_id}'>",
+        ("admin_open_chat_link",), "</a>)\n\n",
+        ("admin_order_data_label",), "\n",
+        "📦 ", ("taobao_order_num_label",), ": {order_number}\n",
+        "📅 ", ("date_label",), ": {order_date}\n",
+        "📍 ", ("location_label",), ": {location}",
+    ),
+}
+FORMAT_KEYS = {"order_x_of_y", "admin_order_found_title"}
+
+
+class Catalog:
+    """Переводы, загруженные и проверенные один раз при старте.
+    Отсутствующий перевод или расхождение подстановок между языками — ошибка загрузки."""
+
+    def __init__(self, path, languages=LANGUAGES):
+        with open(path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        self.languages = languages
+        self._validate(raw)
+        self.texts = {lang: {key: values[lang] for key, values in raw.items()} for lang in languages}
+        self.actions = {
+            (lang, self.texts[lang][key]): action
+            for lang in languages for key, action in MENU_ACTIONS.items()
+        }
+        self.templates = {
+            lang: {name: self._render(lang, parts) for name, parts in TEMPLATES.items()}
+            for lang in languages
+        }
+
+    def _validate(self, raw):
+        errors = []
+        for key, values in raw.items():
+            missing = [lang for lang in self.languages if not values.get(lang)]
+            if missing:
+                errors.append(f"{key}: нет перевода для {', '.join(missing)}")
+                continue
+            fields = {lang: _fields(values[lang]) for lang in self.languages}
+            if len(set(map(frozenset, fields.values()))) > 1:
+                errors.append(f"{key}: подстановки отличаются между языками {fields}")
+        used = set(MENU_ACTIONS) | {part[0] for parts in TEMPLATES.values() for part in parts if isinstance(part, tuple)}
+        errors.extend(f"{key}: ключ отсутствует" for key in sorted(used - set(raw)))
+        if errors:
+            raise ValueError("Ошибки в translations.json:\n" + "\n".join(errors))
+
+    def _render(self, lang, parts):
+        out = []
+        for part in parts:
+            if isinstance(part, tuple):
+                text = self.texts[lang][part[0]]
+                out.append(text if part[0] in FORMAT_KEYS else text.replace("{", "{{").replace("}", "}}"))
+            else:
+                out.append(part)
+        return "".join(out)
+
+    def get(self, key, lang):
+        return self.texts.get(lang or DEFAULT_LANGUAGE, self.texts[DEFAULT_LANGUAGE])[key]
+
+    def action(self, lang, text):
+        """Действие кнопки меню по ее тексту на языке пользователя или None."""
+        return self.actions.get((lang, text))
+
+    def render(self, name, lang, **fields):
+        templates = self.templates.get(lang or DEFAULT_LANGUAGE, self.templates[DEFAULT_LANGUAGE])
+        return templates[name].format(**fields)
+
+
+def _fields(text):
+    return {name for _, name, _, _ in Formatter().parse(text) if name}
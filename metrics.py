@@ -0,0 +1,267 @@
+"""Метрики: время обработчиков, запросов к Telegram, вызовов таблицы и SQL.
+
+Гистограммы и счетчики ошибок копятся в памяти процесса и отдаются в формате Prometheus
+на http://METRICS_HOST:METRICS_PORT/metrics. Вызовы дольше SLOW_CALL_MS пишутся в лог
+одной JSON-строкой. Замер — два perf_counter и одна блокировка на вызов.
+"""
+import asyncio
+import functools
+import json
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+HELP = {
+    "handler": "Telegram update handlers",
+    "telegram": "Bot API requests",
+    "sheets": "Google Sheets calls",
+    "sql": "SQLite statements",
+}
+
+
+class Registry:
+    def __init__(self, slow_threshold=0.5):
+        self.slow_threshold = slow_threshold
+        self._histograms = {}
+        self._errors = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, seconds, error=None):
+        key = (kind, name)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(BUCKETS), 0.0]
+            counts = histogram[0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+            histogram[1] += seconds
+            if error is not None:
+                self._errors[key] = self._errors.get(key, 0) + 1
+        if seconds >= self.slow_threshold:
+            print(json.dumps({"slow_call": kind, "name": name, "ms": round(seconds * 1000, 1),
+                              "error": repr(error) if error is not None else None}, ensure_ascii=False))
+
+    def add_gauges(self, prefix, collect):
+        """collect() -> {имя: число}; вызывается при каждом чтении /metrics."""
+        self._gauges.append((prefix, collect))
+
+    def render(self):
+        with self._lock:
+            histograms = {key: (list(counts), total) for key, (counts, total) in self._histograms.items()}
+            errors = dict(self._errors)
+        lines = []
+        for kind in sorted({kind for kind, _ in histograms}):
+            metric = f"bot_{kind}_seconds"
+            lines += [f"# HELP {metric} {HELP.get(kind, kind)}", f"# TYPE {metric} histogram"]
+            for (k, name), (counts, total) in sorted(histograms.items()):
+                if k != kind:
+                    continue
+                label = _escape(name)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric}_bucket{{name="{label}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{name="{label}"}} {total:.6f}')
+                lines.append(f'{metric}_count{{name="{label}"}} {cumulative}')
+        if errors:
+            lines += ["# HELP bot_errors_total Failed calls", "# TYPE bot_errors_total counter"]
+            lines += [f'bot_errors_total{{kind="{kind}",name="{_escape(name)}"}} {count}'
+                      for (kind, name), count in sorted(errors.items())]
+        for prefix, collect in self._gauges:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Metrics gauge {prefix} failed: {e}")
+                continue
+            for name, value in sorted(values.items()):
+                lines += [f"# TYPE bot_{prefix}_{name} gauge", f"bot_{prefix}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def timed(self, kind, name, fn):
+        """Обертка fn с замером; для корутин — асинхронная."""
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                error = None
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    self.observe(kind, name, time.perf_counter() - start, error)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            error = None
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self.observe(kind, name, time.perf_counter() - start, error)
+        return wrapper
+
+
+registry = Registry()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+# ---------------- Точки замера ----------------
+def instrument_handlers(bot):
+    """Оборачивает все зарегистрированные обработчики сообщений и кнопок."""
+    for handlers in (bot.message_handlers, bot.callback_query_handlers):
+        for handler in handlers:
+            fn = handler["function"]
+            if not getattr(fn, "_metered", False):
+                handler["function"] = registry.timed("handler", fn.__name__, fn)
+                handler["function"]._metered = True
+
+
+def instrument_table(handlers):
+    """Оборачивает обработчики из словаря действий (меню, шаги сценария), которые вызываются не через bot."""
+    for key, fn in handlers.items():
+        handlers[key] = registry.timed("handler", fn.__name__, fn)
+
+
+def instrument_telegram():
+    """Замер всех запросов к Bot API: синхронных (apihelper) и asyncio (asyncio_helper)."""
+    from telebot import apihelper, asyncio_helper
+
+    make_request = apihelper._make_request
+
+    def timed_make_request(token, method_name, method='get', params=None, files=None):
+        if method_name == "getUpdates":
+            # Long polling: время ответа — это время ожидания новых обновлений, а не задержка API
+            return make_request(token, method_name, method, params, files)
+        start = time.perf_counter()
+        error = None
+        try:
+            return make_request(token, method_name, method, params, files)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            registry.observe("telegram", method_name, time.perf_counter() - start, error)
+
+    apihelper._make_request = timed_make_request
+
+    process_request = asyncio_helper._process_request
+
+    async def timed_process_request(token, url, method='get', params=None, files=None, **kwargs):
+        if url == "getUpdates":
+            return await process_request(token, url, method, params, files, **kwargs)
+        start = time.perf_counter()
+        error = None
+        try:
+            return await process_request(token, url, method, params, files, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            registry.observe("telegram", url, time.perf_counter() - start, error)
+
+    asyncio_helper._process_request = timed_process_request
+
+
+class TimedSheet:
+    """Прокси листа gspread: каждый вызов метода попадает в метрики sheets."""
+
+    def __init__(self, sheet):
+        self._sheet = sheet
+
+    def __getattr__(self, name):
+        value = getattr(self._sheet, name)
+        if callable(value):
+            return registry.timed("sheets", name, value)
+        return value
+
+
+def timed_sheet_factory(factory):
+    return lambda: TimedSheet(factory())
+
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=512)
+def statement_name(sql):
+    """Метка запроса: команда и первая таблица («SELECT orders»), чтобы не плодить метки по тексту SQL."""
+    words = sql.split(None, 1)
+    verb = words[0].upper() if words else ""
+    if verb in ("CREATE", "ALTER", "DROP"):
+        return verb
+    table = _TABLE.search(sql)
+    return f"{verb} {table.group(1)}" if table else verb
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение SQLite с замером execute/executemany (без последующего чтения строк курсором)."""
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        error = None
+        try:
+            return super().execute(sql, *args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            registry.observe("sql", statement_name(sql), time.perf_counter() - start, error)
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        error = None
+        try:
+            return super().executemany(sql, *args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            registry.observe("sql", statement_name(sql), time.perf_counter() - start, error)
+
+
+# ---------------- HTTP ----------------
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host, port):
+    """Поднимает /metrics в фоновом потоке. Занятый порт не мешает работе бота."""
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint {host}:{port} unavailable: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
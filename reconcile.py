@@ -0,0 +1,141 @@
+"""Сверка заказов в SQLite с Google-таблицей и починка расхождений пачками.
+
+    python reconcile.py --dry-run        # только отчет
+    python reconcile.py --max-calls 10   # не больше 10 обращений к Sheets API за запуск
+
+Лист читается один раз (get_all_values). Номера заявителей сравниваются как множества:
+- нет в таблице — строки дописываются одним append_rows на пачку;
+- есть, но данные отличаются — строки перезаписываются одним batch_update на пачку;
+- лишние строки и дубли в таблице только попадают в отчет, удалять их безопасно только вручную.
+Строки, которые еще ждут отправки в sheet_outbox, пропущенными не считаются.
+"""
+import argparse
+import json
+import os
+
+import sheets
+
+APPLICANT_COLUMN = sheets.SHEET_HEADER.index("Номер заказа заявителя")
+
+
+def column_letter(number):
+    letters = ""
+    while number:
+        number, rest = divmod(number - 1, 26)
+        letters = chr(ord("A") + rest) + letters
+    return letters
+
+
+def expected_rows(conn):
+    """Строки таблицы по данным SQLite в порядке заказов: {номер заявителя: строка}."""
+    return {
+        row[APPLICANT_COLUMN]: [str(value) if value is not None else "" for value in row]
+        for row in conn.execute("""
+            SELECT u.tg_id, o.full_name, o.phone, o.order_number, o.order_date, COALESCE(o.location, ''),
+                   o.applicant_order_number
+            FROM orders o JOIN users u ON o.user_id = u.id
+            WHERE o.applicant_order_number IS NOT NULL
+            ORDER BY o.id
+        """)
+    }
+
+
+def pending_codes(conn):
+    return {json.loads(row)[APPLICANT_COLUMN] for (row,) in conn.execute("SELECT row FROM sheet_outbox")}
+
+
+def diff(expected, pending, values):
+    """Сравнивает ожидаемые строки с содержимым листа (values — результат get_all_values)."""
+    width = len(sheets.SHEET_HEADER)
+    start = 1 if values and values[0][:width] == sheets.SHEET_HEADER else 0
+    found, duplicates = {}, []
+    for number, row in enumerate(values[start:], start=start + 1):
+        row = (list(row) + [""] * width)[:width]
+        code = row[APPLICANT_COLUMN]
+        if not code:
+            continue
+        if code in found:
+            duplicates.append(code)
+        else:
+            found[code] = (number, row)
+
+    missing = [code for code in expected if code not in found and code not in pending]
+    stale = [(found[code][0], code) for code in expected.keys() & found.keys() if found[code][1] != expected[code]]
+    return {
+        "missing": missing,
+        "stale": sorted(stale),
+        "extra": sorted(found.keys() - expected.keys()),
+        "duplicates": duplicates,
+        "pending": len(pending),
+        "empty": not values,
+    }
+
+
+def repair(sheet, expected, report, batch_size=500, max_calls=20):
+    """Дописывает и перезаписывает строки, не превышая max_calls обращений (одно уже ушло на чтение).
+    Возвращает число сделанных обращений; остаток починится следующим запуском."""
+    calls = 1
+    width = len(sheets.SHEET_HEADER)
+    rows = [expected[code] for code in report["missing"]]
+    if report["empty"] and rows:
+        # Пустой лист: заголовок уходит вместе с первой пачкой строк
+        rows.insert(0, sheets.SHEET_HEADER)
+    for start in range(0, len(rows), batch_size):
+        if calls >= max_calls:
+            return calls
+        sheet.append_rows(rows[start:start + batch_size])
+        calls += 1
+    stale = report["stale"]
+    last = column_letter(width)
+    for start in range(0, len(stale), batch_size):
+        if calls >= max_calls:
+            return calls
+        sheet.batch_update([
+            {"range": f"A{number}:{last}{number}", "values": [expected[code]]}
+            for number, code in stale[start:start + batch_size]
+        ])
+        calls += 1
+    return calls
+
+
+def reconcile(conn, sheet, dry_run=False, batch_size=500, max_calls=20):
+    """Полный проход сверки. Порядок чтения важен: сначала заказы, затем очередь, затем лист —
+    так строка, которую SheetWriter отправляет прямо сейчас, не будет дописана второй раз."""
+    expected = expected_rows(conn)
+    pending = pending_codes(conn)
+    report = diff(expected, pending, sheet.get_all_values())
+    report["calls"] = 1 if dry_run else repair(sheet, expected, report, batch_size, max_calls)
+    return report
+
+
+def summary(report):
+    return (f"missing {len(report['missing'])}, stale {len(report['stale'])}, extra {len(report['extra'])}, "
+            f"duplicates {len(report['duplicates'])}, pending in outbox {report['pending']}, "
+            f"Sheets API calls {report['calls']}")
+
+
+def main():
+    from dotenv import load_dotenv
+
+    import db
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Сверка SQLite и Google-таблицы")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "new_orders.db"))
+    parser.add_argument("--dry-run", action="store_true", help="только показать расхождения")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-calls", type=int, default=20)
+    parser.add_argument("--verbose", action="store_true", help="перечислить номера заказов")
+    args = parser.parse_args()
+
+    sheet = sheets.open_google_sheet(os.getenv("GOOGLE_CREDENTIALS"), os.getenv("GOOGLE_SHEET_ID"))
+    conn = db.connect(args.db)
+    report = reconcile(conn, sheet, args.dry_run, args.batch_size, args.max_calls)
+    print(("dry run: " if args.dry_run else "") + summary(report))
+    if args.verbose:
+        for key in ("missing", "stale", "extra", "duplicates"):
+            print(f"{key}: {report[key]}")
+
+
+if __name__ == '__main__':
+    main()
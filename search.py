@@ -0,0 +1,90 @@
+"""Полнотекстовый поиск заказов для администраторов.
+
+Индекс FTS5 (токенизатор trigram) по ФИО, телефону, номеру заказа Taobao и номеру заявителя
+ищет по любой подстроке от трех символов: часть телефона, фамилия, кусок номера.
+Индекс хранит только ссылки на orders (external content) и обновляется триггерами.
+"""
+
+PAGE_SIZE = 5
+# Сколько самых свежих совпадений ранжируется по релевантности
+MAX_CANDIDATES = 1000
+# Триграммный индекс не ищет подстроки короче трех символов
+MIN_TERM = 3
+
+
+def init_search(cursor):
+    """Создает индекс и триггеры; при первом запуске индексирует существующие заказы."""
+    created = not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orders_fts'").fetchone()
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+        full_name, phone, order_number, applicant_order_number,
+        content = 'orders', content_rowid = 'id', tokenize = 'trigram'
+    )
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO orders_fts (rowid, full_name, phone, order_number, applicant_order_number)
+        VALUES (new.id, new.full_name, new.phone, new.order_number, new.applicant_order_number);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_delete AFTER DELETE ON orders BEGIN
+        INSERT INTO orders_fts (orders_fts, rowid, full_name, phone, order_number, applicant_order_number)
+        VALUES ('delete', old.id, old.full_name, old.phone, old.order_number, old.applicant_order_number);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_update
+    AFTER UPDATE OF full_name, phone, order_number, applicant_order_number ON orders BEGIN
+        INSERT INTO orders_fts (orders_fts, rowid, full_name, phone, order_number, applicant_order_number)
+        VALUES ('delete', old.id, old.full_name, old.phone, old.order_number, old.applicant_order_number);
+        INSERT INTO orders_fts (rowid, full_name, phone, order_number, applicant_order_number)
+        VALUES (new.id, new.full_name, new.phone, new.order_number, new.applicant_order_number);
+    END
+    """)
+    if created:
+        cursor.execute("INSERT INTO orders_fts (orders_fts) VALUES ('rebuild')")
+
+
+def match_query(terms):
+    """Строка MATCH: каждое слово как фраза, все слова обязательны."""
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def relevance(row, terms):
+    """Совпадение со всем полем важнее совпадения с началом слова, а оно — с подстрокой."""
+    score = 0
+    fields = [str(value).lower() for value in row[:4] if value]
+    for term in terms:
+        best = 0
+        for field in fields:
+            if field == term:
+                best = 3
+                break
+            if field.startswith(term) or f" {term}" in field:
+                best = max(best, 2)
+            elif term in field:
+                best = max(best, 1)
+        score += best
+    return score
+
+
+def search_orders(cursor, text, page=0, page_size=PAGE_SIZE):
+    """Страница результатов и число найденных (не больше MAX_CANDIDATES).
+
+    Индекс отдает MAX_CANDIDATES самых новых совпадений обходом по убыванию rowid, без сортировки.
+    bm25 для частых триграмм (например, кода оператора в телефоне) читает весь список документов,
+    поэтому кандидаты ранжируются в Python по relevance, при равенстве — сначала новые.
+    """
+    terms = [term.lower() for term in text.split() if len(term) >= MIN_TERM]
+    if not terms:
+        return [], 0
+    rows = cursor.execute("""
+        SELECT o.applicant_order_number, o.full_name, o.phone, o.order_number, o.order_date
+        FROM (SELECT rowid AS id FROM orders_fts WHERE orders_fts MATCH ? ORDER BY rowid DESC LIMIT ?) c
+        JOIN orders o ON o.id = c.id
+        ORDER BY o.id DESC
+    """, (match_query(terms), MAX_CANDIDATES)).fetchall()
+    # Сортировка устойчива: при равной релевантности сохраняется порядок от новых к старым
+    rows.sort(key=lambda row: relevance(row, terms), reverse=True)
+    return rows[page * page_size:(page + 1) * page_size], len(rows)
@@ -0,0 +1,318 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from telebot import asyncio_helper
+from telebot.apihelper import ApiTelegramException
+
+
+# Сколько ведер чатов держать до первой чистки неиспользуемых (Dispatcher._sweep)
+_SWEEP_MIN = 256
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Забирает токен и возвращает, сколько секунд нужно подождать до его появления."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self):
+        with self._lock:
+            return self.tokens + (time.monotonic() - self.last) * self.rate >= self.capacity
+
+
+class _Job:
+    __slots__ = ("method", "args", "kwargs", "future", "key", "enqueued_at")
+
+    def __init__(self, method, args, kwargs, key):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.key = key
+        self.enqueued_at = time.monotonic()
+
+
+class Dispatcher:
+    """Очередь исходящих запросов к Telegram.
+
+    Сообщения одного чата отправляются строго по порядку и одним воркером за раз.
+    Скорость ограничена глобальным ведром, ведром чата и более строгим ведром для групп
+    администраторов. Ответ 429 выдерживает retry_after и повторяется. Повторные правки
+    одного сообщения, еще не ушедшие в Telegram, схлопываются в одну (последнюю);
+    Future заменённой правки сразу завершается с None.
+    """
+
+    def __init__(self, bot, global_rate=30.0, chat_rate=1.0, group_rate=20 / 60, group_ids=(),
+                 workers=8, max_retries=5):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.group_ids = set(group_ids)
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._buckets = {}
+        self._sweep_at = _SWEEP_MIN
+        self._chats = {}
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"sent": 0, "failed": 0, "retried": 0, "rate_limited": 0, "coalesced": 0,
+                       "delay_sum": 0.0, "delay_max": 0.0}
+        self._workers = [threading.Thread(target=self._work, name=f"sender-{n}", daemon=True)
+                         for n in range(workers)]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    # ---------------- API ----------------
+    def send_message(self, chat_id, *args, **kwargs):
+        return self.submit("send_message", chat_id, (chat_id,) + args, kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        kwargs.update(text=text, chat_id=chat_id, message_id=message_id)
+        return self.submit("edit_message_text", chat_id, (), kwargs, key=("edit", message_id))
+
+    def delete_message(self, chat_id, message_id):
+        return self.submit("delete_message", chat_id, (), {"chat_id": chat_id, "message_id": message_id})
+
+    def send_document(self, chat_id, *args, **kwargs):
+        return self.submit("send_document", chat_id, (chat_id,) + args, kwargs)
+
+    def submit(self, method, chat_id, args, kwargs, key=None):
+        """Ставит вызов bot.<method>(*args, **kwargs) в очередь чата и возвращает Future с результатом."""
+        replaced = None
+        with self._lock:
+            jobs = self._chats.get(chat_id)
+            if key is not None and jobs:
+                for job in jobs:
+                    if job.key == key:
+                        # Правка еще не отправлена — достаточно подменить текст на последний.
+                        # Результат (и ошибка) достается только последнему вызову, заменённый
+                        # завершается с None: иначе каждый вызов обработал бы одну ошибку по-своему
+                        job.args, job.kwargs = args, kwargs
+                        replaced, job.future = job.future, Future()
+                        self._stats["coalesced"] += 1
+                        break
+            if replaced is None:
+                job = _Job(method, args, kwargs, key)
+                if jobs is None:
+                    self._chats[chat_id] = deque([job])
+                    self._ready.put(chat_id)
+                else:
+                    jobs.append(job)
+            future = job.future
+        if replaced is not None:
+            # Колбэки выполняются здесь же — вне блокировки, чтобы они могли снова вызвать submit
+            replaced.set_result(None)
+        return future
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = sum(len(jobs) for jobs in self._chats.values())
+            stats["active_chats"] = len(self._chats)
+        return stats
+
+    def reserve(self, chat_id):
+        """Забирает токены чата и общего ведра; возвращает, сколько секунд подождать перед запросом."""
+        with self._lock:
+            # Токен берется под блокировкой, чтобы ведро не удалили между выдачей и reserve
+            delay = self._bucket(chat_id).reserve()
+        return max(delay, self.global_bucket.reserve())
+
+    # ---------------- Воркеры ----------------
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self._sweep_at:
+                self._sweep()
+            rate = self.group_rate if chat_id in self.group_ids else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, 3)
+        return bucket
+
+    def _sweep(self):
+        """Удаляет полные ведра чатов без очереди: новое ведро было бы таким же.
+        Вызывается под self._lock, когда ведер стало вдвое больше, чем после прошлой чистки,
+        поэтому в памяти только чаты, которым писали последние секунды, а не все за время работы."""
+        self._buckets = {chat_id: bucket for chat_id, bucket in self._buckets.items()
+                         if chat_id in self._chats or not bucket.idle()}
+        self._sweep_at = max(_SWEEP_MIN, 2 * len(self._buckets))
+
+    def _work(self):
+        while True:
+            chat_id = self._ready.get()
+            with self._lock:
+                job = self._chats[chat_id].popleft()
+                bucket = self._bucket(chat_id)
+            self._run(job, bucket)
+            with self._lock:
+                if self._chats[chat_id]:
+                    self._ready.put(chat_id)
+                else:
+                    del self._chats[chat_id]
+
+    def _run(self, job, bucket):
+        delay = max(bucket.reserve(), self.global_bucket.reserve())
+        if delay:
+            time.sleep(delay)
+        waited = time.monotonic() - job.enqueued_at
+        with self._lock:
+            self._stats["delay_sum"] += waited
+            self._stats["delay_max"] = max(self._stats["delay_max"], waited)
+        for attempt in range(self.max_retries + 1):
+            rewind(job.args, job.kwargs)
+            try:
+                result = getattr(self.bot, job.method)(*job.args, **job.kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt == self.max_retries:
+                    return self._fail(job, e)
+                with self._lock:
+                    self._stats["rate_limited"] += 1
+                    self._stats["retried"] += 1
+                time.sleep(retry_after(e))
+            except Exception as e:
+                return self._fail(job, e)
+            else:
+                with self._lock:
+                    self._stats["sent"] += 1
+                job.future.set_result(result)
+                return
+
+    def _fail(self, job, error):
+        with self._lock:
+            self._stats["failed"] += 1
+        print(f"Telegram {job.method} failed: {error}")
+        job.future.set_exception(error)
+
+
+class AsyncDispatcher:
+    """Исходящие запросы AsyncTeleBot с теми же правилами, что у Dispatcher.
+
+    Запросы одного чата идут по порядку, ожидание токенов и retry_after после 429 не занимают поток.
+    Правка сообщения, еще ждущая своей очереди, подменяется более новой правкой того же сообщения;
+    результат достается последнему вызову, заменённый возвращает None.
+    Ведра общие с переданным Dispatcher: в режиме asyncio через него идут рассылки и отчеты,
+    и вместе они укладываются в лимиты бота. Ошибка запроса пишется в лог, вызов возвращает None
+    (submit с raise_errors=True поднимает ее — чтобы отличить от заменённой правки).
+    """
+
+    def __init__(self, bot, dispatcher):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self._chats = {}
+        self._stats = {"sent": 0, "failed": 0, "rate_limited": 0, "coalesced": 0}
+
+    async def send_message(self, chat_id, *args, **kwargs):
+        return await self.submit("send_message", chat_id, (chat_id,) + args, kwargs)
+
+    async def edit_message_text(self, text, chat_id, message_id, raise_errors=False, **kwargs):
+        kwargs.update(text=text, chat_id=chat_id, message_id=message_id)
+        return await self.submit("edit_message_text", chat_id, (), kwargs, key=("edit", message_id),
+                                 raise_errors=raise_errors)
+
+    async def delete_message(self, chat_id, message_id):
+        return await self.submit("delete_message", chat_id, (), {"chat_id": chat_id, "message_id": message_id})
+
+    async def send_document(self, chat_id, *args, **kwargs):
+        return await self.submit("send_document", chat_id, (chat_id,) + args, kwargs)
+
+    async def submit(self, method, chat_id, args, kwargs, key=None, raise_errors=False):
+        """Выполняет bot.<method>(*args, **kwargs) после предыдущих запросов этого чата."""
+        # chat_id -> [блокировка, число ожидающих, ждущие правки по key];
+        # asyncio.Lock отдает очередь в порядке вызовов
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0, {}])
+        future = asyncio.get_running_loop().create_future()
+        if key is not None and key in entry[2]:
+            # Правка еще не отправлена — подменяем текст, запрос выполнит тот, кто стоит в очереди
+            call = entry[2][key]
+            call[0], call[1], call[3] = args, kwargs, raise_errors
+            replaced, call[2] = call[2], future
+            replaced.set_result(None)
+            self._stats["coalesced"] += 1
+            return await future
+        # [args, kwargs, Future последнего вызова, его raise_errors]
+        call = [args, kwargs, future, raise_errors]
+        if key is not None:
+            entry[2][key] = call
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if key is not None:
+                    del entry[2][key]
+                try:
+                    result = await self._run(method, chat_id, call[0], call[1])
+                except Exception as e:
+                    if call[3]:
+                        call[2].set_exception(e)
+                    else:
+                        call[2].set_result(None)
+                else:
+                    call[2].set_result(result)
+        finally:
+            if not call[2].done():
+                # Вызов отменен: заменившие его не должны ждать вечно
+                if key is not None and entry[2].get(key) is call:
+                    del entry[2][key]
+                call[2].set_result(None)
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat_id]
+        return await future
+
+    def metrics(self):
+        return dict(self._stats, active_chats=len(self._chats))
+
+    async def _run(self, method, chat_id, args, kwargs):
+        delay = self.dispatcher.reserve(chat_id)
+        if delay:
+            await asyncio.sleep(delay)
+        max_retries = self.dispatcher.max_retries
+        for attempt in range(max_retries + 1):
+            rewind(args, kwargs)
+            try:
+                result = await getattr(self.bot, method)(*args, **kwargs)
+            except asyncio_helper.ApiTelegramException as e:
+                if e.error_code != 429 or attempt == max_retries:
+                    self._fail(method, e)
+                    raise
+                self._stats["rate_limited"] += 1
+                await asyncio.sleep(retry_after(e))
+            except Exception as e:
+                self._fail(method, e)
+                raise
+            else:
+                self._stats["sent"] += 1
+                return result
+
+    def _fail(self, method, error):
+        self._stats["failed"] += 1
+        print(f"Telegram {method} failed: {error}")
+
+
+def retry_after(error):
+    """Пауза из ответа 429 (parameters.retry_after), по умолчанию секунда."""
+    return (error.result_json or {}).get("parameters", {}).get("retry_after", 1)
+
+
+def rewind(args, kwargs):
+    """Возвращает открытые файлы (send_document) в начало: прошлая попытка дочитала их до конца."""
+    for value in (*args, *kwargs.values()):
+        if hasattr(value, "seek"):
+            value.seek(0)
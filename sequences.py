@@ -0,0 +1,57 @@
+import threading
+
+
+def init_sequences(cursor):
+    """Создает таблицу счетчиков."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+
+
+def seed_applicant_sequence(cursor, base=1000):
+    """Заводит счетчик номеров Gv по уже выданным номерам. Таблица orders читается только при первом запуске."""
+    if cursor.execute("SELECT 1 FROM sequences WHERE name = 'applicant'").fetchone():
+        return
+    row = cursor.execute(
+        "SELECT MAX(CAST(SUBSTR(applicant_order_number, 3) AS INTEGER)) FROM orders "
+        "WHERE applicant_order_number LIKE 'Gv%'"
+    ).fetchone()
+    cursor.execute("INSERT INTO sequences (name, value) VALUES ('applicant', ?)", (max(base, row[0] or 0),))
+
+
+def next_value(conn, name, step=1):
+    """Атомарно сдвигает счетчик на step и возвращает новое значение.
+    Внутри открытой транзакции значение откатится вместе с ней."""
+    return conn.execute(
+        "UPDATE sequences SET value = value + ? WHERE name = ? RETURNING value", (step, name)
+    ).fetchone()[0]
+
+
+class BlockAllocator:
+    """Выдает значения счетчика из заранее зарезервированного блока.
+    Блок берется одной короткой транзакцией, дальше значения раздаются из памяти.
+    Значения растут монотонно в пределах процесса; остаток блока при перезапуске теряется."""
+
+    def __init__(self, conn, name, block=100):
+        self.conn = conn
+        self.name = name
+        self.block = block
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            if self._next >= self._end:
+                with self.conn:
+                    end = next_value(self.conn, self.name, self.block)
+                self._next, self._end = end - self.block, end
+            self._next += 1
+            return self._next
+
+
+def applicant_code(value):
+    return f"Gv{value}"
@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+
+SHEET_HEADER = [
+    "Telegram ID", "ФИО", "Телефон",
+    "Номер заказа (Taobao)", "Дата заказа",
+    "Локация", "Номер заказа заявителя"
+]
+
+
+# ---------------- Outbox ----------------
+def init_outbox(cursor):
+    """Создает таблицу очереди строк для Google Sheets и таблицу служебных отметок."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sheet_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        row TEXT NOT NULL,
+        attempts INTEGER DEFAULT 0,
+        next_try_at REAL DEFAULT 0
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sheet_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+
+
+def enqueue_row(cursor, row):
+    """Кладет строку в очередь. Вызывается в той же транзакции, что и INSERT в orders."""
+    cursor.execute("INSERT INTO sheet_outbox (row) VALUES (?)", (json.dumps(row, ensure_ascii=False),))
+
+
+# ---------------- Подключение ----------------
+def open_google_sheet(credentials_file, sheet_id):
+    """Авторизуется в Google и открывает первый лист. Импорты тяжелые, поэтому выполняются здесь."""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+    creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
+    client = gspread.authorize(creds)
+    return client.open_by_key(sheet_id).sheet1
+
+
+def ensure_header(conn, sheet, sheet_key=None):
+    """Проверяет заголовок по первой строке листа, а не по всей таблице.
+    Для sheet_key результат запоминается в sheet_meta, и повторные запуски лист не читают."""
+    marker = f"header_verified:{sheet_key}"
+    if sheet_key and conn.execute("SELECT 1 FROM sheet_meta WHERE key = ?", (marker,)).fetchone():
+        return
+    if not sheet.row_values(1):
+        sheet.append_row(SHEET_HEADER)
+    if sheet_key:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO sheet_meta (key, value) VALUES (?, ?)", (marker, str(time.time())))
+
+
+# ---------------- Локальная таблица ----------------
+class FakeSheet:
+    """Локальная замена листа gspread: хранит строки в памяти, для офлайн-прогонов."""
+
+    def __init__(self, latency=0.0):
+        self.rows = []
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def row_values(self, row):
+        with self._lock:
+            self._call()
+            return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def get_all_values(self):
+        with self._lock:
+            self._call()
+            return [list(r) for r in self.rows]
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        with self._lock:
+            self._call()
+            self.rows.extend([[str(v) for v in r] for r in values])
+
+    def batch_update(self, data, **kwargs):
+        """Поддерживает диапазоны вида A5:G5 — одна строка на диапазон."""
+        with self._lock:
+            self._call()
+            for item in data:
+                number = int(item["range"].split(":")[0].lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+                while len(self.rows) < number:
+                    self.rows.append([])
+                self.rows[number - 1] = [str(v) for v in item["values"][0]]
+
+
+# ---------------- Фоновая запись ----------------
+class SheetWriter(threading.Thread):
+    """Разбирает sheet_outbox и отправляет строки одним append_rows на пачку.
+    Лист открывается лениво через sheet_factory уже в фоновом потоке."""
+
+    def __init__(self, db_path, sheet_factory, sheet_key=None, batch_size=50, flush_interval=5.0,
+                 max_backoff=300.0, reconcile_interval=0.0):
+        super().__init__(name="sheet-writer", daemon=True)
+        self.db_path = db_path
+        self.sheet_factory = sheet_factory
+        self.sheet_key = sheet_key
+        self.sheet = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.reconcile_interval = reconcile_interval
+        self._last_reconcile = time.time()
+        self._wake = threading.Event()
+        self._pending = 0
+
+    def notify(self):
+        """Сообщает о новой строке; при накоплении batch_size строк будит поток раньше таймера."""
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._wake.set()
+
+    def run(self):
+        import db
+
+        # Соединение из db.connect: WAL, ожидание блокировки и замер SQL вместе с остальными запросами
+        conn = db.connect(self.db_path)
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._pending = 0
+            try:
+                if self.sheet is None:
+                    sheet = self.sheet_factory()
+                    ensure_header(conn, sheet, self.sheet_key)
+                    self.sheet = sheet
+                self.flush(conn)
+                if self.reconcile_interval and time.time() - self._last_reconcile > self.reconcile_interval:
+                    self._last_reconcile = time.time()
+                    self.reconcile(conn)
+            except Exception as e:
+                print(f"Sheet writer error: {e}")
+
+    def reconcile(self, conn):
+        """Сверка с листом в этом же потоке: пока она идет, outbox не отправляется и строки не задвоятся."""
+        from reconcile import reconcile, summary
+
+        print(f"Sheets reconcile: {summary(reconcile(conn, self.sheet))}")
+
+    def flush(self, conn):
+        """Отправляет все готовые строки пачками. При ошибке откладывает пачку с экспоненциальной задержкой."""
+        while True:
+            batch = conn.execute(
+                "SELECT id, row, attempts FROM sheet_outbox WHERE next_try_at <= ? ORDER BY id LIMIT ?",
+                (time.time(), self.batch_size)
+            ).fetchall()
+            if not batch:
+                return
+            ids = [(row_id,) for row_id, _, _ in batch]
+            try:
+                self.sheet.append_rows([json.loads(row) for _, row, _ in batch])
+            except Exception as e:
+                attempts = batch[0][2] + 1
+                delay = min(self.max_backoff, 2 ** attempts)
+                print(f"Sheets append failed ({len(batch)} rows, attempt {attempts}), retry in {delay}s: {e}")
+                with conn:
+                    conn.execute("BEGIN")
+                    conn.executemany(
+                        "UPDATE sheet_outbox SET attempts = attempts + 1, next_try_at = ? WHERE id = ?",
+                        [(time.time() + delay, row_id) for (row_id,) in ids]
+                    )
+                return
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany("DELETE FROM sheet_outbox WHERE id = ?", ids)
@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import db
+
+# Сценарии, которые хранятся раздельно для одного чата
+WIZARD = "wizard"
+
+_EMPTY = (None, None, float("inf"))
+
+
+class StateStore:
+    """Состояния диалогов по chat_id: шаг сценария и компактный словарь данных.
+    Записи сохраняются в SQLite и переживают перезапуск; в памяти держится не больше max_items
+    последних записей (max_items=0 — без памяти, каждое чтение из SQLite: так несколько
+    процессов без закрепления чатов видят одно и то же состояние). Брошенные сценарии истекают через ttl секунд."""
+
+    def __init__(self, ttl=86400.0, max_items=10000, purge_interval=600.0):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.purge_interval = purge_interval
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+
+    def get(self, chat_id, flow=WIZARD):
+        """Возвращает (step, data) или (None, {}), если состояния нет или оно истекло."""
+        key = (chat_id, flow)
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+        if item is None:
+            row = db.get_conversation(chat_id, flow)
+            # Отсутствие состояния тоже запоминается, чтобы обычные сообщения не ходили в БД
+            item = (row[0], row[1], row[2] + self.ttl) if row else _EMPTY
+            self._remember(key, item)
+        step, data, expires_at = item
+        if step is None:
+            return None, {}
+        if expires_at < now:
+            self.clear(chat_id, flow)
+            return None, {}
+        return step, json.loads(data)
+
+    def set(self, chat_id, step, data, flow=WIZARD):
+        now = time.time()
+        packed = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        self._remember((chat_id, flow), (step, packed, now + self.ttl))
+        self._written(db.save_conversation(chat_id, flow, step, packed, now))
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            db.purge_conversations(now - self.ttl)
+
+    def clear(self, chat_id, flow=WIZARD):
+        self._remember((chat_id, flow), _EMPTY)
+        self._written(db.delete_conversation(chat_id, flow))
+
+    def _written(self, future):
+        # Без памяти следующее чтение идет в SQLite — запись должна быть уже закоммичена
+        if not self.max_items:
+            future.result()
+
+    def _remember(self, key, item):
+        with self._lock:
+            self._items[key] = item
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
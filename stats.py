@@ -0,0 +1,118 @@
+"""Статистика для администраторов: счетчики, которые обновляются в той же транзакции,
+что и само изменение (новый пользователь, согласие, шаг сценария, заказ).
+Панель статистики читает готовые значения и не считает COUNT по таблицам.
+
+    python stats.py                  # пересобрать счетчики по users/orders (DB_PATH или new_orders.db)
+    python stats.py --db other.db
+"""
+import argparse
+import os
+
+# Шаг сценария -> этап воронки; "final_save" засчитывается при сохранении заказа
+FUNNEL = (
+    ("name", "get_name"),
+    ("phone", "get_phone"),
+    ("order_number", "get_order_number"),
+    ("location", "get_location"),
+    (None, "final_save"),
+)
+_FUNNEL_STEPS = {step: stage for step, stage in FUNNEL if step}
+
+
+def init_stats(cursor):
+    """Создает таблицу счетчиков; при первом запуске на существующей БД заполняет ее."""
+    created = not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats'").fetchone()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats (
+        name TEXT,
+        key TEXT,
+        value INTEGER NOT NULL,
+        PRIMARY KEY (name, key)
+    ) WITHOUT ROWID
+    """)
+    # Постоянные клиенты читаются по индексу, без сортировки всей таблицы
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_orders_count ON users (orders_count)")
+    if created:
+        backfill(cursor)
+
+
+def bump(cursor, name, key="", delta=1):
+    cursor.execute(
+        "INSERT INTO stats (name, key, value) VALUES (?, ?, ?) "
+        "ON CONFLICT (name, key) DO UPDATE SET value = value + excluded.value",
+        (name, key, delta)
+    )
+
+
+def record_step(cursor, old_step, new_step):
+    """Засчитывает переход сценария на новый шаг воронки. Повтор того же шага не считается."""
+    stage = _FUNNEL_STEPS.get(new_step)
+    if stage and new_step != old_step:
+        bump(cursor, "funnel", stage)
+
+
+def record_order(cursor, user_id, order_date):
+    language = cursor.execute("SELECT language_code FROM users WHERE id = ?", (user_id,)).fetchone()
+    bump(cursor, "orders")
+    bump(cursor, "orders_day", order_date[:10])
+    bump(cursor, "orders_language", (language and language[0]) or "")
+    bump(cursor, "funnel", "final_save")
+
+
+def backfill(cursor):
+    """Пересобирает счетчики по таблицам users и orders.
+    Этапы воронки до final_save в таблицах не хранятся, поэтому они сохраняются как есть."""
+    cursor.execute("DELETE FROM stats WHERE name != 'funnel' OR key = 'final_save'")
+    cursor.execute("INSERT INTO stats (name, key, value) SELECT 'users', '', COUNT(*) FROM users")
+    cursor.execute("INSERT INTO stats (name, key, value) SELECT 'agreed', '', COUNT(*) FROM users WHERE agreed = 1")
+    cursor.execute("INSERT INTO stats (name, key, value) SELECT 'orders', '', COUNT(*) FROM orders")
+    cursor.execute("INSERT INTO stats (name, key, value) SELECT 'funnel', 'final_save', COUNT(*) FROM orders")
+    cursor.execute("""
+        INSERT INTO stats (name, key, value)
+        SELECT 'orders_day', COALESCE(SUBSTR(order_date, 1, 10), ''), COUNT(*) FROM orders GROUP BY 1, 2
+    """)
+    cursor.execute("""
+        INSERT INTO stats (name, key, value)
+        SELECT 'orders_language', COALESCE(u.language_code, ''), COUNT(*)
+        FROM orders o LEFT JOIN users u ON o.user_id = u.id GROUP BY 1, 2
+    """)
+
+
+def dashboard(cursor, days=7, top=5):
+    """Готовые агрегаты для панели статистики."""
+    values = dict(cursor.execute("SELECT name, value FROM stats WHERE key = '' AND name IN ('users', 'agreed', 'orders')"))
+    return {
+        "users": values.get("users", 0),
+        "agreed": values.get("agreed", 0),
+        "orders": values.get("orders", 0),
+        "days": cursor.execute(
+            "SELECT key, value FROM stats WHERE name = 'orders_day' ORDER BY key DESC LIMIT ?", (days,)
+        ).fetchall(),
+        "languages": cursor.execute(
+            "SELECT key, value FROM stats WHERE name = 'orders_language' ORDER BY value DESC"
+        ).fetchall(),
+        "funnel": dict(cursor.execute("SELECT key, value FROM stats WHERE name = 'funnel'")),
+        "top": cursor.execute(
+            "SELECT tg_id, orders_count FROM users WHERE orders_count > 1 ORDER BY orders_count DESC LIMIT ?", (top,)
+        ).fetchall(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересборка счетчиков статистики")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "new_orders.db"))
+    args = parser.parse_args()
+
+    import db
+
+    conn = db.connect(args.db)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        db.init_schema(conn)
+        backfill(conn)
+    totals = dict(conn.execute("SELECT name, SUM(value) FROM stats GROUP BY name"))
+    print(f"stats rebuilt: {totals}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Режим нескольких процессов: обновления получает один процесс, обрабатывают N воркеров.
+
+    WORKER_PROCESSES=4 python supervisor.py
+
+Супервизор опрашивает getUpdates и раскладывает обновления по воркерам по хешу chat.id:
+все обновления чата попадают в один процесс и обрабатываются по порядку, поэтому шаги
+сценария не перемешиваются, а кеши пользователей и состояний в процессах не расходятся.
+Внутри воркера обновления так же делятся по потокам (webhook.UpdateQueues).
+
+SQLite общая: WAL, в каждом процессе свой поток записи, между процессами запись
+сериализует блокировка базы (BEGIN IMMEDIATE с ожиданием до 30 с).
+Выгрузка в Google Sheets и сверка идут только в супервизоре. Его /metrics — на METRICS_PORT,
+воркера i — на METRICS_PORT + 1 + i.
+Лимиты Telegram общие на бота: SEND_GLOBAL_RATE, SEND_GROUP_RATE и BROADCAST_RATE делятся
+между воркерами поровну, а сам супервизор сообщений не отправляет. Прерванные рассылки при
+запуске продолжает воркер 0 в пределах своей доли.
+Упавший воркер перезапускается; обновления из его очереди достаются новому процессу,
+а те, что он уже взял в работу, теряются — как и при падении бота в одном процессе.
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+from telebot import apihelper
+
+POLL_TIMEOUT = 20
+MIN_UPTIME = 10.0
+
+
+def raw_chat_id(update):
+    """chat.id для обновления в виде JSON (как webhook.update_chat_id для разобранного); 0, если чата нет."""
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        if key == "callback_query":
+            message = value.get("message")
+            return message["chat"]["id"] if message else value["from"]["id"]
+        owner = value.get("chat") or value.get("from")
+        if owner:
+            return owner["id"]
+    return 0
+
+
+def run_worker(index, updates, env, resume_broadcasts=False):
+    """Процесс-воркер: модуль bot без фоновых задач супервизора, обновления из своей очереди."""
+    os.environ.update(env)
+    # Импорт здесь: при spawn этот модуль загружается в воркере заново, а bot — только один раз
+    import bot as core
+    import metrics
+    import webhook
+    from telebot import types
+
+    core.bot.threaded = False
+    core.dispatcher.start()
+    if resume_broadcasts:
+        core.broadcaster.resume()
+    if core.METRICS_PORT:
+        metrics.serve(core.METRICS_HOST, core.METRICS_PORT)
+    # Буфер внутри процесса небольшой: очередь супервизора при падении воркера переживет, а этот буфер — нет
+    local = webhook.UpdateQueues(core.bot.process_new_updates, core.WORKER_THREADS, core.WORKER_THREADS * 4)
+    local.start()
+    parent = os.getppid()
+    print(f"Worker {index} started, pid {os.getpid()}")
+    while True:
+        try:
+            update = updates.get(timeout=1)
+        except queue.Empty:
+            if os.getppid() != parent:
+                return
+            continue
+        local.put(types.Update.de_json(update), block=True)
+
+
+class Supervisor:
+    """Процессы-воркеры с очередями обновлений; чат закреплен за одним воркером."""
+
+    def __init__(self, count, queue_size=1000, env=None):
+        self.context = multiprocessing.get_context("spawn")
+        self.queue_size = queue_size
+        self.env = env or (lambda index: {})
+        self.queues = [self.context.Queue(queue_size) for _ in range(count)]
+        self.processes = [None] * count
+        self.started_at = [0.0] * count
+        self.restarts = 0
+
+    def start(self):
+        # Рассылки продолжаются только при первом запуске: перезапущенный воркер не знает,
+        # не идет ли рассылка в другом процессе, и мог бы отправить ее второй раз
+        for index in range(len(self.processes)):
+            self._spawn(index, resume_broadcasts=index == 0)
+
+    def _spawn(self, index, resume_broadcasts=False):
+        process = self.context.Process(target=run_worker,
+                                       args=(index, self.queues[index], self.env(index), resume_broadcasts),
+                                       name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+
+    def check(self):
+        """Перезапускает упавшие воркеры. Очередь пересоздается: мертвый процесс мог оставить ее заблокированной."""
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            print(f"Worker {index} exited with code {process.exitcode}, restarting")
+            if time.monotonic() - self.started_at[index] < MIN_UPTIME:
+                time.sleep(1)
+            old, new = self.queues[index], self.context.Queue(self.queue_size)
+            salvaged = 0
+            while True:
+                try:
+                    new.put_nowait(old.get(timeout=0.1))
+                    salvaged += 1
+                except queue.Empty:
+                    break
+            old.close()
+            old.cancel_join_thread()
+            if salvaged:
+                print(f"Worker {index}: {salvaged} queued updates moved to the new process")
+            self.queues[index] = new
+            self.restarts += 1
+            self._spawn(index)
+
+    def put(self, update):
+        """Отдает обновление воркеру его чата; при заполненной очереди ждет (и опрос Telegram тоже)."""
+        index = hash(raw_chat_id(update)) % len(self.queues)
+        while True:
+            try:
+                self.queues[index].put(update, timeout=1)
+                return
+            except queue.Full:
+                self.check()
+
+    def metrics(self):
+        return {
+            "alive": sum(process.is_alive() for process in self.processes),
+            "restarts": self.restarts,
+            "queue_depth": sum(q.qsize() for q in self.queues),
+        }
+
+    def poll(self, token, timeout=POLL_TIMEOUT):
+        """Long polling: обновления подтверждаются следующим запросом, после передачи воркерам."""
+        offset = None
+        while True:
+            try:
+                updates = apihelper.get_updates(token, offset, 100, timeout, long_polling_timeout=timeout)
+            except Exception as e:
+                print(f"getUpdates failed: {e}")
+                time.sleep(3)
+                continue
+            self.check()
+            for update in updates:
+                self.put(update)
+                offset = update["update_id"] + 1
+
+
+def main():
+    import bot as core
+    import metrics
+
+    count = max(1, core.WORKER_PROCESSES)
+
+    def worker_env(index):
+        # Лимиты Telegram общие на бота, поэтому каждому воркеру — своя доля
+        return {
+            "SEND_GLOBAL_RATE": str(core.SEND_GLOBAL_RATE / count),
+            "SEND_GROUP_RATE": str(core.SEND_GROUP_RATE / count),
+            "BROADCAST_RATE": str(core.BROADCAST_RATE / count),
+            "METRICS_PORT": str(core.METRICS_PORT + 1 + index if core.METRICS_PORT else 0),
+        }
+
+    supervisor = Supervisor(count, core.WORKER_QUEUE_SIZE, worker_env)
+    if core.METRICS_PORT:
+        metrics.registry.add_gauges("workers", supervisor.metrics)
+    def stop(signum, frame):
+        # Повторный SIGTERM (его получает вся группа процессов) не должен прерывать остановку воркеров
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        sys.exit(0)
+
+    # SIGTERM (systemd, kill) завершает процесс штатно: воркеры-демоны останавливаются вместе с ним
+    signal.signal(signal.SIGTERM, stop)
+    supervisor.start()
+    core.start_background(send=False)
+    core.print_startup_report()
+    supervisor.poll(core.TOKEN)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Режим webhook: встроенный HTTP-сервер вместо long polling.
+
+Сервер проверяет секретный токен, разбирает обновление и сразу отвечает 200,
+а обработка идет в пуле воркеров. Обновления одного чата всегда попадают в одну
+очередь, поэтому шаги сценария выполняются по порядку. Если очередь заполнена,
+сервер отвечает 503 и Telegram повторит доставку позже.
+TLS ожидается на обратном прокси (nginx и т.п.) перед сервером.
+
+Несколько экземпляров за балансировщиком (WEBHOOK_INSTANCES > 1) работают с одной базой,
+и обновления чата могут попасть в любой из них. Порядок шагов по чату тогда держится только
+внутри экземпляра, а кеши пользователей и состояний в памяти отключаются: шаг сценария и язык
+всегда читаются из SQLite. Лимиты отправки SEND_GLOBAL_RATE, SEND_GROUP_RATE и BROADCAST_RATE
+делятся между экземплярами поровну. Выгрузку в Google Sheets и прерванные рассылки ведет
+только экземпляр с WEBHOOK_INSTANCE=0, у остальных задайте 1, 2, ... (и разные WEBHOOK_PORT,
+METRICS_PORT). Один экземпляр (по умолчанию) кеширует как обычно.
+"""
+import hmac
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update):
+    """chat.id обновления для распределения по очередям; 0, если чата нет."""
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        message = update.callback_query.message
+        return message.chat.id if message else update.callback_query.from_user.id
+    return 0
+
+
+class UpdateQueues:
+    """Ограниченные очереди обновлений с воркерами; чат закреплен за одной очередью."""
+
+    def __init__(self, process, workers=8, queue_size=1000):
+        self.process = process
+        self.queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self._work, args=(q,), name=f"update-worker-{n}", daemon=True)
+            for n, q in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, update, block=False):
+        """Ставит обновление в очередь его чата. False, если очередь заполнена (только при block=False)."""
+        try:
+            self.queues[hash(update_chat_id(update)) % len(self.queues)].put(update, block=block)
+            return True
+        except queue.Full:
+            return False
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _work(self, q):
+        while True:
+            update = q.get()
+            try:
+                self.process([update])
+            except Exception as e:
+                print(f"Update processing error: {e}")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, updates, path="/webhook", secret=None):
+        super().__init__(address, WebhookHandler)
+        self.updates = updates
+        self.webhook_path = path
+        self.secret = secret
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        if self.path != server.webhook_path:
+            return self._reply(404)
+        if server.secret and not hmac.compare_digest(self.headers.get(SECRET_HEADER, ""), server.secret):
+            return self._reply(403)
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            update = types.Update.de_json(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            return self._reply(400)
+        self._reply(200 if server.updates.put(update) else 503)
+
+    def _reply(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(bot, host, port, url=None, secret=None, path="/webhook", workers=8, queue_size=1000):
+    """Регистрирует webhook в Telegram (если передан url) и обслуживает запросы до остановки процесса."""
+    # Обработчики выполняются в наших воркерах: так сохраняется порядок по чатам и работает backpressure
+    bot.threaded = False
+    updates = UpdateQueues(bot.process_new_updates, workers, queue_size)
+    updates.start()
+    if url:
+        bot.remove_webhook()
+        bot.set_webhook(url=url, secret_token=secret)
+    server = WebhookServer((host, port), updates, path, secret)
+    server.serve_forever()